@@ -0,0 +1,191 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+from typing import Dict, List
+
+import numpy as np
+import psutil
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.stub_server import start_stub_server
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "vifactcheck_fixture.jsonl")
+
+
+class PeakMemory:
+    # Sample the process RSS in the background while a block runs. growth is the peak over the RSS
+    # at entry, which the loaded models otherwise dominate
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.process = psutil.Process()
+        self.start = 0
+        self.peak = 0
+
+    @property
+    def growth(self):
+        return self.peak - self.start
+
+    def _sample(self):
+        while not self.stopped.is_set():
+            self.peak = max(self.peak, self.process.memory_info().rss)
+            self.stopped.wait(self.interval)
+
+    def __enter__(self):
+        self.start = self.process.memory_info().rss
+        self.peak = self.start
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._sample, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stopped.set()
+        self.thread.join()
+        self.peak = max(self.peak, self.process.memory_info().rss)
+
+
+# Distinct fixture samples needed before a tail percentile says anything, repeats of a sample do not count
+MIN_SAMPLES = {95: 20, 99: 100}
+
+
+def percentile_ms(latencies, q: int, distinct: int):
+    if distinct < MIN_SAMPLES.get(q, 0):
+        return None
+    return float(np.percentile(latencies, q) * 1000)
+
+
+def summarize(latencies: List[float], distinct: int, peak_growth: int, peak_rss: int = None):
+    latencies = np.array(latencies)
+    summary = {
+        'samples': int(len(latencies)),
+        'samples_per_sec': float(len(latencies) / latencies.sum()) if latencies.sum() > 0 else None,
+        'p50_ms': percentile_ms(latencies, 50, distinct),
+        'p95_ms': percentile_ms(latencies, 95, distinct),
+        'p99_ms': percentile_ms(latencies, 99, distinct),
+        'peak_rss_growth_mb': peak_growth / 2 ** 20,
+    }
+    if peak_rss is not None:
+        summary['peak_rss_mb'] = peak_rss / 2 ** 20
+    return summary
+
+
+def load_fixture(path: str):
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def make_fixture(path: str, size: int, dataset: str, split: str):
+    # Freeze the first samples of a split so every commit is measured on the same input
+    from utils.dataset import ViFactCheck
+    data = ViFactCheck(dataset, splits=[split], lazy=True)
+    with open(path, "w", encoding="utf-8") as f:
+        for sample in data[0:size]:
+            f.write(json.dumps(sample, ensure_ascii=False) + "\n")
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(samples: List[Dict], corrector, repeat: int, warmup: int):
+    stages = corrector.stages()
+
+    # Warm up caches and lazy initialization outside of the measurements
+    for sample in samples[:warmup]:
+        corrector.correct(dict(sample))
+
+    # Each stage is fed with the output of the previous one
+    stage_latencies = {name: [] for name, _ in stages}
+    stage_peaks = {name: 0 for name, _ in stages}
+    for _ in range(repeat):
+        for sample in samples:
+            sample = dict(sample)
+            for name, function in stages:
+                with PeakMemory() as memory:
+                    start_time = time.perf_counter()
+                    sample = function(sample)
+                    stage_latencies[name].append(time.perf_counter() - start_time)
+                stage_peaks[name] = max(stage_peaks[name], memory.growth)
+
+    pipeline_latencies = []
+    with PeakMemory() as memory:
+        for _ in range(repeat):
+            for sample in samples:
+                start_time = time.perf_counter()
+                corrector.correct(dict(sample))
+                pipeline_latencies.append(time.perf_counter() - start_time)
+
+    return {
+        'stages': {name: summarize(stage_latencies[name], len(samples), stage_peaks[name]) for name, _ in stages},
+        'pipeline': summarize(pipeline_latencies, len(samples), memory.growth, memory.peak),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark of the Vi_ZeroFEC stages")
+    parser.add_argument("--fixture", default=FIXTURE, help="JSONL file of ViFactCheck samples")
+    parser.add_argument("--output", default="benchmark.json", help="JSON results file")
+    parser.add_argument("--latency-ms", type=float, default=200, help="Latency of the stub LLM server")
+    parser.add_argument("--jitter-ms", type=float, default=0, help="Latency jitter of the stub LLM server")
+    parser.add_argument("--repeat", type=int, default=3, help="Passes over the fixture")
+    parser.add_argument("--warmup", type=int, default=1, help="Samples run before measuring")
+    parser.add_argument("--threads", type=int, default=None, help="Torch threads")
+    parser.add_argument("--pack-size", type=int, default=1, help="Claim units or question-answer pairs per LLM request")
+    parser.add_argument("--make-fixture", type=int, default=None, metavar="N", help="Write the first N samples of --split to --fixture and exit")
+    parser.add_argument("--dataset", default="hf://datasets/tranthaihoa/vifactcheck_gold_evidence/")
+    parser.add_argument("--split", default="test")
+    args = parser.parse_args()
+
+    if args.make_fixture:
+        make_fixture(args.fixture, args.make_fixture, args.dataset, args.split)
+        return
+
+    import torch
+    from model.vi_zerofec import Vi_ZeroFEC
+    from utils.llm_scheduler import LLMScheduler
+
+    torch.manual_seed(0)
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    # Replace the Together API with the local stub
+    server, base_url = start_stub_server(args.latency_ms, args.jitter_ms)
+    scheduler = LLMScheduler(api_key="stub", base_url=base_url, requests_per_second=1000, max_retries=0)
+    corrector = Vi_ZeroFEC(llm_scheduler=scheduler, llm_pack_size=args.pack_size)
+
+    samples = load_fixture(args.fixture)
+    if len(samples) < MIN_SAMPLES[95]:
+        print(f"{args.fixture} has {len(samples)} samples, p95/p99 are not reported: regenerate it with --make-fixture 50")
+    results = run(samples, corrector, args.repeat, args.warmup)
+    results['config'] = {
+        'commit': git_commit(),
+        'fixture': os.path.basename(args.fixture),
+        'fixture_samples': len(samples),
+        'repeat': args.repeat,
+        'latency_ms': args.latency_ms,
+        'jitter_ms': args.jitter_ms,
+        'pack_size': args.pack_size,
+        'torch_threads': torch.get_num_threads(),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+    }
+
+    scheduler.close()
+    server.shutdown()
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    print(json.dumps(results['pipeline'], indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def stub_question(information):
+    return f"{information.strip()} là gì?"
+
+
+def stub_claim(question, answer):
+    return f"{question.strip().rstrip('?')} là {answer.strip()}."
+
+
+def stub_completion(messages):
+    # Deterministic answer shaped like the real generations of each prompt
+    user_content = messages[-1]['content']
+
+    # Packed prompts list their items on numbered lines and expect a JSON list back
+    items = re.findall(r"^\s*\d+\.\s*(.*)$", user_content, re.MULTILINE)
+    if len(items) > 1:
+        outputs = []
+        for item in items:
+            pair = re.match(r"Câu hỏi:\s*(.*) \| Trả lời:\s*(.*)", item)
+            outputs.append(stub_claim(pair.group(1), pair.group(2)) if pair else stub_question(item))
+        return json.dumps(outputs, ensure_ascii=False)
+
+    information = re.search(r"Thông tin:\s*(.*)", user_content)
+    question = re.search(r"Câu hỏi:\s*(.*)", user_content)
+    answer = re.search(r"Trả lời:\s*(.*)", user_content)
+
+    if information:
+        return stub_question(information.group(1))
+    if question and answer:
+        return stub_claim(question.group(1), answer.group(1))
+    return hashlib.sha1(user_content.encode("utf-8")).hexdigest()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    # Set on the server: mean latency and jitter in seconds, and the number of requests
+    # still to answer with 429 before serving completions
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self.send_error(404)
+            return
+
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        with self.server.lock:
+            self.server.requests += 1
+            rate_limited = self.server.failures > 0
+            self.server.failures -= rate_limited
+        if rate_limited:
+            self.send_error(429, "Rate limited")
+            return
+        content = stub_completion(body['messages'])
+
+        # Latency is seeded by the request so reruns sleep the same amounts
+        rng = random.Random(content)
+        time.sleep(max(0.0, self.server.latency + rng.uniform(-self.server.jitter, self.server.jitter)))
+
+        prompt_tokens = sum(len(message['content']) for message in body['messages']) // 3
+        completion_tokens = len(content) // 3
+        response = {
+            "id": hashlib.sha1(content.encode("utf-8")).hexdigest(),
+            "object": "chat.completion",
+            "created": 0,
+            "model": body.get("model", "stub"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        }
+
+        payload = json.dumps(response, ensure_ascii=False).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub_server(latency_ms=200, jitter_ms=0, host="127.0.0.1", port=0, failures=0):
+    # Serve an OpenAI-compatible chat completion endpoint in a background thread,
+    # the first `failures` requests get a 429 to exercise retries
+    server = ThreadingHTTPServer((host, port), StubHandler)
+    server.daemon_threads = True
+    server.latency = latency_ms / 1000
+    server.jitter = jitter_ms / 1000
+    server.failures = failures
+    server.requests = 0
+    server.lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, name="stub-llm-server", daemon=True).start()
+
+    base_url = f"http://{host}:{server.server_address[1]}/v1"
+    return server, base_url
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Deterministic stub of the Together chat completion API")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency-ms", type=float, default=200)
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    args = parser.parse_args()
+
+    server, base_url = start_stub_server(args.latency_ms, args.jitter_ms, port=args.port)
+    print(f"Stub LLM server listening on {base_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
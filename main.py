@@ -1,13 +1,166 @@
+import argparse
+import multiprocessing as mp
+import os
+from utils.checkpoint import load_processed_ids, sample_id
 from utils.dataset import ViFactCheck
-from model.vi_zerofec import Vi_ZeroFEC
+from utils.sharding import find_shard_outputs, merge_shard_outputs, parse_shard, shard_indices, shard_layouts, shard_output_path
 
-# Load model
-corrector = Vi_ZeroFEC()
 
-# Load all dataset
-vifactcheck = ViFactCheck("hf://datasets/tranthaihoa/vifactcheck_gold_evidence/")
-dataset = vifactcheck.get_all()
+def parse_args():
+    parser = argparse.ArgumentParser(description="Correct ViFactCheck claims with Vi_ZeroFEC")
+    parser.add_argument("--dataset", default="hf://datasets/tranthaihoa/vifactcheck_gold_evidence/", help="ViFactCheck base path")
+    parser.add_argument("--output", default="outputs.jsonl", help="Merged output file, JSONL or .parquet")
+    parser.add_argument("--splits", default="train,dev,test", help="Comma-separated dataset splits")
+    parser.add_argument("--start", type=int, default=0, help="First dataset index to process")
+    parser.add_argument("--end", type=int, default=None, help="Dataset index to stop at (exclusive)")
+    parser.add_argument("--shard", default=None, help="Process shard i of N of the selected range, e.g. 2/4 (default: 0/1)")
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes on this machine, each loads its own model")
+    parser.add_argument("--threads", type=int, default=None, help="Torch threads per worker (default: cores / workers)")
+    parser.add_argument("--backend", default="torch", choices=["torch", "onnx"], help="Inference backend of the QA and entailment models")
+    parser.add_argument("--cascade-threshold", type=float, default=None, help="Return claims entailed by the evidence with at least this score without correcting them")
+    parser.add_argument("--pack-size", type=int, default=1, help="Claim units or question-answer pairs per LLM request")
+    parser.add_argument("--generation-model", default=None, help="Local seq2seq checkpoint for question and claim generation instead of the Together API")
+    parser.add_argument("--evidence-window", type=int, default=None, help="Score long evidence in overlapping windows of this many tokens instead of truncating it")
+    parser.add_argument("--prune-units", action="store_true", help="Drop claim units overlapping a better ranked one before question generation")
+    parser.add_argument("--max-units", type=int, default=None, help="Keep at most this many claim units per claim, implies --prune-units")
+    parser.add_argument("--answer-filter", type=float, default=None, help="Drop QA pairs under this confidence or whose answer equals its claim unit before claim generation")
+    parser.add_argument("--requests-per-second", type=float, default=5, help="LLM request rate limit of the whole run, split across the workers")
+    parser.add_argument("--tokens-per-minute", type=int, default=None, help="LLM token rate limit of the whole run, split across the workers")
+    parser.add_argument("--llm-cache", default=None, metavar="PATH", help="SQLite cache of LLM generations shared by the workers and reruns")
+    parser.add_argument("--llm-cache-replay", action="store_true", help="Only read --llm-cache, a missing generation fails the sample instead of calling the API")
+    parser.add_argument("--batch-size", type=int, default=16, help="Samples per batch through the batched stages, 0 corrects them one at a time")
+    parser.add_argument("--pipelined", action="store_true", help="Overlap the correction stages inside each worker")
+    parser.add_argument("--metrics-file", default=None, help="Write metrics per worker (.prom for Prometheus text, JSON otherwise)")
+    parser.add_argument("--trace-file", default=None, help="Write stage and LLM request spans per worker as JSONL")
+    parser.add_argument("--merge", action="store_true", help="Only merge existing shard outputs into --output")
+    return parser.parse_args()
 
-# Correct samples
-samples = dataset[0:500]
-outputs = corrector.batch_correct(samples, "/content/drive/MyDrive/NLP/outputs.jsonl")
+
+def run_worker(indices, output_file, threads, previous_parts, args, metrics_file=None, trace_file=None):
+    # Cap the thread pools before torch and tokenizers are imported in this process
+    for name in ["OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"]:
+        os.environ[name] = str(threads)
+    os.environ["TOKENIZERS_PARALLELISM"] = "false"
+
+    import torch
+    torch.set_num_threads(threads)
+    torch.set_num_interop_threads(1)
+
+    from model.vi_zerofec import Vi_ZeroFEC
+    from utils.llm_cache import LLMCache
+    from utils.llm_scheduler import LLMScheduler
+    from utils.metrics import configure_metrics
+
+    metrics = configure_metrics(enabled=metrics_file is not None or trace_file is not None, trace_file=trace_file)
+    llm_cache = LLMCache(args.llm_cache, replay=args.llm_cache_replay) if args.llm_cache else None
+    # This worker's share of the run's rate limits, not needed with a local generation model
+    llm_scheduler = None
+    if args.generation_model is None:
+        llm_scheduler = LLMScheduler(
+            requests_per_second=args.requests_per_second / args.workers,
+            tokens_per_minute=args.tokens_per_minute // args.workers if args.tokens_per_minute else None
+        )
+
+    # Load model
+    corrector = Vi_ZeroFEC(llm_cache=llm_cache, llm_scheduler=llm_scheduler, inference_backend=args.backend,
+                           cascade_threshold=args.cascade_threshold, llm_pack_size=args.pack_size,
+                           local_generation_model=args.generation_model, evidence_window_size=args.evidence_window,
+                           answer_filter_threshold=args.answer_filter, prune_claim_units=args.prune_units,
+                           max_claim_units=args.max_units)
+
+    # Resume from every part of this shard, whatever the number of workers that wrote it
+    processed_ids = set()
+    for path in previous_parts:
+        processed_ids |= load_processed_ids(path)
+
+    # Samples are built from the dataset one by one as the corrector consumes them
+    dataset = ViFactCheck(args.dataset, splits=args.splits.split(","), lazy=True)
+    samples = (
+        sample
+        for sample in ({**dataset[i], 'index': i} for i in indices)
+        if sample_id(sample) not in processed_ids
+    )
+
+    # Correct samples
+    try:
+        corrector.batch_correct(samples, output_file, pipelined=args.pipelined, keep_results=False,
+                                batch_size=args.batch_size or None)
+    finally:
+        dataset.close()
+        if llm_scheduler is not None:
+            llm_scheduler.close()
+        if llm_cache is not None:
+            llm_cache.close()
+        if metrics_file is not None:
+            metrics.write(metrics_file)
+        metrics.close()
+
+
+def merge_layout(output_file: str, shard_arg: str = None):
+    # Shard count to merge: the one of --shard, or the only layout on disk
+    if shard_arg is not None:
+        return parse_shard(shard_arg)[1]
+    layouts = shard_layouts(output_file)
+    if len(layouts) != 1:
+        raise SystemExit(f"Found parts of {output_file} for shard counts {layouts}, pass --shard i/N to pick one")
+    return layouts[0]
+
+
+def main():
+    args = parse_args()
+    shard, num_shards = parse_shard(args.shard or "0/1")
+
+    if not args.merge:
+        # Only the size of the dataset is needed here
+        dataset = ViFactCheck(args.dataset, splits=args.splits.split(","), lazy=True)
+        end = len(dataset) if args.end is None else min(args.end, len(dataset))
+        dataset.close()
+
+        # Split the selected range across machines
+        indices = shard_indices(list(range(args.start, end)), shard, num_shards)
+        threads = args.threads or max(1, (os.cpu_count() or 1) // args.workers)
+
+        # Workers get index lists, each one builds its samples and skips those already in the parts of this shard
+        previous_parts = find_shard_outputs(args.output, shard, num_shards)
+        jobs = []
+        run_parts = list(previous_parts)
+        for worker in range(args.workers):
+            output_file = shard_output_path(args.output, shard, num_shards, worker, args.workers)
+            if output_file not in run_parts:
+                run_parts.append(output_file)
+            metrics_file = shard_output_path(args.metrics_file, shard, num_shards, worker, args.workers) if args.metrics_file else None
+            trace_file = shard_output_path(args.trace_file, shard, num_shards, worker, args.workers) if args.trace_file else None
+            jobs.append((shard_indices(indices, worker, args.workers), output_file, threads, previous_parts, args, metrics_file, trace_file))
+
+        if args.workers == 1:
+            run_worker(*jobs[0])
+        else:
+            context = mp.get_context("spawn")
+            processes = [context.Process(target=run_worker, args=job) for job in jobs]
+            for process in processes:
+                process.start()
+            for process in processes:
+                process.join()
+
+            # A crashed worker leaves an incomplete part, do not merge it as if it succeeded
+            failed = [worker for worker, process in enumerate(processes) if process.exitcode != 0]
+            if failed:
+                raise SystemExit(f"Workers {failed} failed, rerun the same command to resume")
+
+        # Other machines merge with --merge once every shard is done
+        if num_shards > 1:
+            return
+        paths = run_parts
+    else:
+        num_shards = merge_layout(args.output, args.shard)
+        missing = [i for i in range(num_shards) if not find_shard_outputs(args.output, i, num_shards)]
+        if missing:
+            raise SystemExit(f"Shards {missing} of {num_shards} have no output to merge")
+        paths = find_shard_outputs(args.output, num_shards=num_shards)
+
+    count = merge_shard_outputs(args.output, paths)
+    print(f"Merged {count} samples into {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+import asyncio
+from typing import Callable, List
+
+from utils.metrics import get_metrics
+
+
+class MicroBatcher:
+    def __init__(self, name: str, function: Callable[[List], List], max_batch_size=16, max_wait_ms=10, concurrency=1, executor=None):
+        # function takes a list of items and returns their results in the same order,
+        # it runs in the executor so the event loop keeps accepting requests.
+        # concurrency: batches running at once, 1 for local models, more for remote calls
+        self.name = name
+        self.function = function
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.concurrency = concurrency
+        self.executor = executor
+        self.queue = None
+        self.slots = None
+        self.in_flight = 0
+        self.task = None
+        self.batches = set()
+
+    def start(self):
+        # Must be called from the running event loop
+        self.queue = asyncio.Queue()
+        self.slots = asyncio.Semaphore(self.concurrency)
+        self.task = asyncio.get_running_loop().create_task(self._run())
+
+    @property
+    def queue_depth(self):
+        return self.queue.qsize() if self.queue is not None else 0
+
+    async def submit(self, item):
+        # Wait for the result of one item, cancelling the caller drops the item if it is still queued
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((item, future))
+        return await future
+
+    async def _collect(self):
+        # First item blocks, the others are taken until the batch is full or max_wait has passed
+        batch = [await self.queue.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        # Skip requests cancelled or timed out while waiting
+        return [(item, future) for item, future in batch if not future.cancelled()]
+
+    async def _call(self, batch):
+        loop = asyncio.get_running_loop()
+        try:
+            results = await loop.run_in_executor(self.executor, self.function, [item for item, _ in batch])
+        except Exception as e:
+            if len(batch) == 1:
+                future = batch[0][1]
+                if not future.done():
+                    future.set_exception(e)
+                return
+            # Retry one by one so a bad request does not fail the others of its batch
+            get_metrics().inc('micro_batch_failures', stage=self.name)
+            for item in batch:
+                await self._call([item])
+            return
+
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    async def _process(self, batch):
+        metrics = get_metrics()
+        metrics.observe('micro_batch_size', len(batch), stage=self.name)
+        self.in_flight += len(batch)
+        try:
+            with metrics.timer('micro_batch_seconds', stage=self.name):
+                await self._call(batch)
+        finally:
+            self.in_flight -= len(batch)
+            self.slots.release()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            # Collect the next batch only once a slot is free, so waiting requests keep joining it
+            await self.slots.acquire()
+            batch = await self._collect()
+            if not batch:
+                self.slots.release()
+                continue
+            task = loop.create_task(self._process(batch))
+            self.batches.add(task)
+            task.add_done_callback(self.batches.discard)
+
+    async def close(self):
+        # Stop collecting, batches already running in the executor are left to finish
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
@@ -0,0 +1,103 @@
+import queue
+import threading
+from typing import Callable, Dict, Iterable, List, Tuple
+
+# Marker sent through the queues once the input is exhausted
+_STOP = object()
+
+
+class StageExecutor:
+    def __init__(self, stages: List[Tuple[str, Callable]], concurrency: Dict[str, int] = None, queue_size=8):
+        # stages: ordered (name, function) pairs, each function takes and returns a sample
+        self.stages = stages
+        self.concurrency = concurrency or {}
+        self.queue_size = queue_size
+
+    def _put(self, q, item, stopped):
+        # Block while the next stage is full (backpressure), but give up once the run is stopped
+        while not stopped.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def _feed(self, samples, q, stopped, failures):
+        # Always send the marker, an input that raises ends the run instead of leaving it waiting
+        try:
+            for idx, sample in enumerate(samples):
+                if stopped.is_set():
+                    return
+                self._put(q, (idx, sample, None), stopped)
+        except BaseException as e:
+            failures.append(e)
+        finally:
+            self._put(q, _STOP, stopped)
+
+    def _work(self, name, function, in_queue, out_queue, remaining, lock, stopped):
+        while not stopped.is_set():
+            try:
+                item = in_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+
+            if item is _STOP:
+                # Let sibling workers see the marker, the last one forwards it downstream
+                self._put(in_queue, _STOP, stopped)
+                with lock:
+                    remaining[name] -= 1
+                    last = remaining[name] == 0
+                if last:
+                    self._put(out_queue, _STOP, stopped)
+                return
+
+            idx, sample, error = item
+            if error is None:
+                try:
+                    sample = function(sample)
+                except Exception as e:
+                    error = e
+            self._put(out_queue, (idx, sample, error), stopped)
+
+    def run(self, samples: Iterable):
+        # Yield (sample, error) pairs in input order, error is None on success
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in range(len(self.stages) + 1)]
+        stopped = threading.Event()
+        lock = threading.Lock()
+        remaining = {}
+        failures = []
+
+        threads = [threading.Thread(target=self._feed, args=(samples, queues[0], stopped, failures), daemon=True)]
+        for i, (name, function) in enumerate(self.stages):
+            workers = max(1, self.concurrency.get(name, 1))
+            remaining[name] = workers
+            for _ in range(workers):
+                threads.append(threading.Thread(
+                    target=self._work,
+                    args=(name, function, queues[i], queues[i + 1], remaining, lock, stopped),
+                    name=f"{name}-worker",
+                    daemon=True
+                ))
+
+        for thread in threads:
+            thread.start()
+
+        # Reorder finished samples so the output follows the input order
+        pending = {}
+        next_idx = 0
+        try:
+            while True:
+                item = queues[-1].get()
+                if item is _STOP:
+                    break
+                idx, sample, error = item
+                pending[idx] = (sample, error)
+                while next_idx in pending:
+                    yield pending.pop(next_idx)
+                    next_idx += 1
+
+            # Samples read before the input failed are yielded first, then its error is raised
+            if failures:
+                raise failures[0]
+        finally:
+            stopped.set()
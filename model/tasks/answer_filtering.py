@@ -0,0 +1,60 @@
+from typing import Dict, List
+from model.tasks.lexical_scoring import tokenize
+from utils.metrics import get_metrics
+
+# Per-question fields filtered together
+QA_FIELDS = ('generated_question', 'question_source', 'answer', 'answer_score', 'answer_start', 'answer_end')
+
+class AnswerFilter:
+    def __init__(self, min_score=0.05):
+        # Minimum QA confidence of an evidence answer worth rewriting into a candidate claim
+        self.min_score = min_score
+
+    def is_consistent(self, answer: str, source: str, score: float):
+        # Low-confidence answers are noise, and an answer equal to its claim unit only rebuilds the input claim
+        if score is not None and score < self.min_score:
+            return False
+        return source is None or tokenize(answer) != tokenize(source)
+
+    def filter_answers(self, sample: Dict):
+        return self.batch_filter_answers([sample])[0]
+
+    def batch_filter_answers(self, samples: List[Dict]):
+        total = 0
+        for sample in samples:
+            count = len(sample['answer'])
+            sources = sample.get('question_source') or [None] * count
+            scores = sample.get('answer_score') or [None] * count
+            keep = [
+                i for i in range(count)
+                if self.is_consistent(sample['answer'][i], sources[i], scores[i])
+            ]
+
+            for field in QA_FIELDS:
+                if field in sample:
+                    sample[field] = [sample[field][i] for i in keep]
+            sample['num_filtered_answers'] = count - len(keep)
+            total += count - len(keep)
+
+        get_metrics().inc('filtered_answers', total)
+        return samples
+
+
+if __name__ == "__main__":
+    # Input
+    sample = {
+        'input_claim': "SAWACO thông báo tạm ngưng cung cấp nước để thực hiện công tác bảo trì, bảo dưỡng định kỳ Nhà máy nước Tân Hiệp, thời gian thực hiện dự kiến từ 12 giờ ngày 25-3 (thứ bảy) đến 4 giờ ngày 26-3 (chủ nhật).",
+        'generated_question': ['Ai thông báo tạm ngưng cung cấp nước?', 'Việc cung cấp nước bắt đầu ngưng từ lúc nào?', 'Nhà máy nước nào được bảo trì?'],
+        'question_source': ['SAWACO', '12 giờ ngày 25-3', 'Nhà máy nước Tân Hiệp'],
+        'answer': ['SAWACO', '22 giờ ngày 25-3', 'Tân Hiệp'],
+        'answer_score': [0.93, 0.81, 0.01],
+    }
+
+    # Answer filtering
+    answer_filter = AnswerFilter()
+    result = answer_filter.filter_answers(sample)
+
+    print(f"Filtered answers: {result['num_filtered_answers']}")
+    for question, answer in zip(result['generated_question'], result['answer']):
+        print(f"\nQuestion: {question}")
+        print(f"Answer: {answer}")
@@ -1,22 +1,56 @@
-from typing import Dict
+from typing import Dict, List
 import stanza
 import torch
+import re
+from utils.metrics import get_metrics
 
-# Function to get all sentence phrases
-def get_phrases(tree, label):
-    if tree.is_leaf():
-        return []
-    results = []
-    for child in tree.children:
-        results += get_phrases(child, label)
+# Function to get all sentence phrases of the given labels in one iterative traversal
+def get_phrases(tree, labels=('NP', 'VP')):
+    phrases = {label: [] for label in labels}
+    leaves = []
+    stack = [(tree, None)]
+    while stack:
+        node, slot = stack.pop()
+        if slot is not None:
+            # All leaves of the node have been seen: fill in its phrase
+            label, idx, start = slot
+            phrases[label][idx] = ' '.join(leaves[start:])
+            continue
+        if node.is_leaf():
+            leaves.append(node.label)
+            continue
 
-    if tree.label == label:
-        return [' '.join(tree.leaf_labels())] + results
-    else:
-        return results
+        if node.label in phrases:
+            # Reserve the position now to keep the parent-before-children order
+            phrases[node.label].append(None)
+            stack.append((node, (node.label, len(phrases[node.label]) - 1, len(leaves))))
+        stack.extend((child, None) for child in reversed(node.children))
+
+    return phrases
+
+# Selection tiers of information units, lower is kept first
+ENTITY_TIER = 0
+WORD_TIER = 1
+PHRASE_TIER = 2
+
+def tokenize_unit(text):
+    return re.findall(r"\w+", text.lower())
 
 class ClaimAnswerGenerator:
-    def __init__(self):
+    def __init__(self, prune_units=False, max_units=None, max_overlap=0.5, max_unit_ratio=0.8, max_entity_tokens=8,
+                 batch_size=64):
+        # Unit selection: drop units nested in or overlapping a kept one (containment >= max_overlap),
+        # units restating most of the claim (> max_unit_ratio of its tokens), and keep at most max_units
+        self.prune_units = prune_units
+        self.max_units = max_units
+        self.max_overlap = max_overlap
+        self.max_unit_ratio = max_unit_ratio
+        # Units with a number rank as entities only up to this many tokens, longer phrases keep their tier
+        self.max_entity_tokens = max_entity_tokens
+
+        # Number of claims annotated per Stanza call
+        self.batch_size = batch_size
+
         self.nlp_stanza = stanza.Pipeline(
             lang="vi",
             processors="tokenize,ner,pos,constituency",
@@ -26,7 +60,24 @@ class ClaimAnswerGenerator:
     def extract_information_units(self, sample: Dict):
         # Use Stanza to annotate the text
         doc = self.nlp_stanza(sample['input_claim'])
+        get_metrics().inc('forward_passes', model='stanza')
+        get_metrics().observe('forward_batch_size', 1, model='stanza')
 
+        return self._extract_from_doc(sample, doc)
+
+    def batch_extract_information_units(self, samples: List[Dict]):
+        # Annotate many claims in one Stanza call per batch
+        for start in range(0, len(samples), self.batch_size):
+            batch = samples[start:start + self.batch_size]
+            docs = self.nlp_stanza.bulk_process([sample['input_claim'] for sample in batch])
+            get_metrics().inc('forward_passes', model='stanza')
+            get_metrics().observe('forward_batch_size', len(batch), model='stanza')
+            for sample, doc in zip(batch, docs):
+                self._extract_from_doc(sample, doc)
+
+        return samples
+
+    def _extract_from_doc(self, sample: Dict, doc):
         # Extract entities
         ents = []
         spe_char = [".", ",", "(", ")", "!"]
@@ -34,17 +85,21 @@ class ClaimAnswerGenerator:
             if ent.text not in spe_char:
                 ents.append(ent.text)
 
+        entities = list(ents)
+
         # Extract word types (POS tagging)
-        ents += [
+        words = [
             word.text
             for sentence in doc.sentences
             for word in sentence.words
             if word.upos in ['VERB', 'NOUN', 'ADJ', 'ADV']
         ]
+        ents += words
 
         # Extract noun phrases and verb phrases
-        ents += [phrase for sent in doc.sentences for phrase in get_phrases(sent.constituency, 'NP')]
-        ents += [phrase for sent in doc.sentences for phrase in get_phrases(sent.constituency, 'VP')]
+        phrases = [get_phrases(sent.constituency) for sent in doc.sentences]
+        ents += [phrase for sent_phrases in phrases for phrase in sent_phrases['NP']]
+        ents += [phrase for sent_phrases in phrases for phrase in sent_phrases['VP']]
 
         # Extract negation terms
         negations = [word for word in ["không", "chưa", "chẳng"] if word in sample['input_claim']]
@@ -66,10 +121,80 @@ class ClaimAnswerGenerator:
         results = list(set(ents + negations + middle))
         for i in range(len(results)):
             results[i] = results[i].replace("_", " ")
+
+        if self.prune_units:
+            tiers = {}
+            for unit in results:
+                tiers[unit] = PHRASE_TIER
+            for unit in words:
+                tiers[unit.replace("_", " ")] = WORD_TIER
+            for unit in entities + negations:
+                tiers[unit.replace("_", " ")] = ENTITY_TIER
+            num_units = len(results)
+            results = self.select_information_units(sample['input_claim'], results, tiers)
+            sample['num_pruned_units'] = num_units - len(results)
+
         sample['claim_answer'] = results
 
         return sample
 
+    def select_information_units(self, claim: str, units: List[str], tiers: Dict[str, int]):
+        claim_tokens = tokenize_unit(claim)
+        candidates = {}
+        for unit in units:
+            unit_tokens = tokenize_unit(unit)
+            if not unit_tokens:
+                continue
+
+            # Locate the unit in the claim, falling back to matching tokens one by one
+            span = None
+            for start in range(len(claim_tokens) - len(unit_tokens) + 1):
+                if claim_tokens[start:start + len(unit_tokens)] == unit_tokens:
+                    span = frozenset(range(start, start + len(unit_tokens)))
+                    break
+            if span is None:
+                span = frozenset(i for i, token in enumerate(claim_tokens) if token in unit_tokens)
+            if not span or len(span) > self.max_unit_ratio * len(claim_tokens):
+                continue
+
+            # Short numbers and dates are as error-prone as named entities
+            numeric = len(unit_tokens) <= self.max_entity_tokens and any(token.isdigit() for token in unit_tokens)
+            tier = ENTITY_TIER if numeric else tiers.get(unit, PHRASE_TIER)
+
+            # Keep one unit per normalized text
+            key = tuple(unit_tokens)
+            if key not in candidates or (tier, len(unit)) < candidates[key][0:2]:
+                candidates[key] = (tier, len(unit), unit, span)
+
+        # Drop units overlapping a better ranked one. Containment (overlap over the smaller span) catches
+        # units nested in each other, which Jaccard misses when their lengths differ. Entity-like units
+        # are kept first, most specific first, then the phrases covering the most claim tokens
+        def rank(candidate):
+            tier, length, unit, span = candidate
+            size = len(span) if tier == ENTITY_TIER else -len(span)
+            return (tier != ENTITY_TIER, size, tier, length, unit)
+
+        kept = []
+        for tier, _, unit, span in sorted(candidates.values(), key=rank):
+            if all(len(span & other) / min(len(span), len(other)) < self.max_overlap for _, _, other in kept):
+                kept.append((tier, unit, span))
+
+        # Cap by budget: greedily take the unit covering the most new claim tokens, entity-like ones first
+        if self.max_units is not None and len(kept) > self.max_units:
+            selected = []
+            covered = set()
+            remaining = list(kept)
+            while remaining and len(selected) < self.max_units:
+                best = max(remaining, key=lambda c: (len(c[2] - covered) * (2 if c[0] == ENTITY_TIER else 1), -c[0], -len(c[2])))
+                remaining.remove(best)
+                selected.append(best)
+                covered |= best[2]
+            kept = selected
+
+        # Return units in claim order
+        kept.sort(key=lambda c: (min(c[2]), -len(c[2])))
+        return [unit for _, unit, _ in kept]
+
 
 if __name__ == "__main__":
     # Input sample
@@ -1,81 +1,168 @@
 import torch
 import torch.nn as nn
 from transformers import AutoTokenizer, AutoModelForSequenceClassification
-from rouge_score import rouge_scorer
+from typing import Dict, List
+from model.tasks.lexical_scoring import LexicalScorer, tokenize
+from utils.metrics import get_metrics
+from utils.onnx_backend import load_onnx_model
 import numpy as np
 
 # Initialize variables
 label_list = ["entailment", "not_entailment"]
 num_labels = len(label_list)
 
+def deduplicate_candidates(candidates: List[str], input_claim: str, near_duplicate_threshold=None):
+    # Drop candidates equal to the input claim or to an earlier candidate after normalization,
+    # and optionally those whose token Jaccard with a kept one reaches near_duplicate_threshold
+    kept = []
+    kept_tokens = [tokenize(input_claim)]
+    for candidate in candidates:
+        tokens = tokenize(candidate)
+        if not tokens or tokens in kept_tokens:
+            continue
+        if near_duplicate_threshold is not None and any(
+            len(set(tokens) & set(other)) / len(set(tokens) | set(other)) >= near_duplicate_threshold
+            for other in kept_tokens[1:]
+        ):
+            continue
+        kept.append(candidate)
+        kept_tokens.append(tokens)
+
+    return kept
+
 class EntailmentModel:
-    def __init__(self, entailment_model_path='vinai/phobert-base-v2', entailment_tokenizer_path="vinai/phobert-base-v2"):
+    def __init__(self, entailment_model_path='vinai/phobert-base-v2', entailment_tokenizer_path="vinai/phobert-base-v2", batch_size=32,
+                 backend="torch", onnx_cache_dir=None, quantize=True, num_threads=None, torch_model=None,
+                 window_size=None, window_stride=None, max_windows=8, windows_per_candidate=2):
         # Model and tokenizer for entailment score
-        self.device = "cuda" if torch.cuda.is_available() else "cpu"
-        self.model = AutoModelForSequenceClassification.from_pretrained(entailment_model_path, num_labels=num_labels).to(self.device)
         self.tokenizer = AutoTokenizer.from_pretrained(entailment_tokenizer_path)
+        if backend == "onnx":
+            # ONNX Runtime on CPU, the graph is exported on first use and cached on disk
+            from optimum.onnxruntime import ORTModelForSequenceClassification
+            self.device = "cpu"
+            self.model = load_onnx_model(
+                ORTModelForSequenceClassification,
+                lambda: torch_model or AutoModelForSequenceClassification.from_pretrained(entailment_model_path, num_labels=num_labels),
+                self.tokenizer,
+                entailment_model_path,
+                output_names=["logits"],
+                cache_dir=onnx_cache_dir,
+                quantize=quantize,
+                num_threads=num_threads
+            )
+        else:
+            self.device = "cuda" if torch.cuda.is_available() else "cpu"
+            self.model = torch_model or AutoModelForSequenceClassification.from_pretrained(entailment_model_path, num_labels=num_labels)
+            self.model.to(self.device).eval()
 
-        # Initialize ROUGE scorer
-        self.rouge_scorer = rouge_scorer.RougeScorer(['rouge1', 'rouge2', 'rougeL'], use_stemmer=True)
-
-    def compute_rouge(self, sentence1, sentence2):
-        # Compute ROUGE scores
-        scores = self.rouge_scorer.score(sentence1, sentence2)
-        rouge = scores['rouge1'].fmeasure
-
-        return rouge
-
-    def compute_entailment(self, sample):
-        sample['entailment_score'] = []
-        sample['rouge_score'] = []
-
-        sample['candidate'] = sample['candidate'] + [sample['input_claim']]  # Add input claim to handle verified claims
-        for correction in sample['candidate']:
-            current_entailment_scores = []
-
-            # Compute ROUGE between input claim and candidate
-            rouge_score = self.compute_rouge(correction, sample['input_claim'])
-            sample['rouge_score'].append(rouge_score)
-
-            # Handle evidence
-            evidence = sample['evidence']
-            encoded_evidence = self.tokenizer.encode(evidence, add_special_tokens=False)[:-1]
-            encoded_correction = self.tokenizer.encode(correction, add_special_tokens=False)[1:]
-
-            # Ensure combined length is within the maximum allowed
-            max_model_length = self.tokenizer.model_max_length
-            max_length = max_model_length - 3
-            encoded_ctx_truncated = encoded_evidence[:max_length - len(encoded_correction)]
-
-            # Create input_ids and attention_mask
-            input_ids = [self.tokenizer.cls_token_id] + encoded_ctx_truncated + [self.tokenizer.sep_token_id] + encoded_correction + [self.tokenizer.sep_token_id]
-            attention_mask = [1] * len(input_ids)
+        # Number of (evidence, candidate) pairs scored per forward pass
+        self.batch_size = batch_size
 
-            # Ensure lengths match
-            # assert len(input_ids) == len(attention_mask), "Mismatch between input_ids and attention_mask lengths!"
+        # Sliding windows over evidence too long for the model, off by default (the evidence is truncated).
+        # Each candidate is scored against its windows_per_candidate most overlapping windows, keeping the max.
+        # Windows are shrunk to fit next to the longest candidate of a sample, the stride defaults to half a window
+        self.window_size = window_size
+        self.window_stride = window_stride
+        self.max_windows = max_windows
+        self.windows_per_candidate = windows_per_candidate
 
-            # Convert to tensors and move to device
-            input_ids = torch.LongTensor(input_ids).unsqueeze(0).to(self.device)
-            attention_mask = torch.LongTensor(attention_mask).unsqueeze(0).to(self.device)
+        # Lexical scorer, only ROUGE-1 enters the final score
+        self.lexical_scorer = LexicalScorer(metrics=('rouge1',))
 
-            # Compute entailment score
-            inputs = {"input_ids": input_ids, "attention_mask": attention_mask}
-            with torch.no_grad():
-                self.model.eval()
+    def compute_rouge(self, sentence1, sentence2):
+        # ROUGE-1 F-measure of a single pair
+        return float(self.lexical_scorer.score(sentence1, [sentence2])['rouge1'][0])
+
+    def _evidence_windows(self, encoded_evidence: List[int], window_size: int):
+        # Overlapping token windows, computed once per evidence
+        if len(encoded_evidence) <= window_size:
+            return [encoded_evidence]
+
+        # A stride over the window size would leave tokens that are never scored
+        stride = max(1, min(self.window_stride or window_size // 2, window_size))
+        last_start = len(encoded_evidence) - window_size
+        starts = list(range(0, last_start, stride)) + [last_start]
+        if len(starts) > self.max_windows:
+            # Keep the first and last windows and spread the others evenly
+            step = (len(starts) - 1) / max(1, self.max_windows - 1)
+            starts = [starts[round(i * step)] for i in range(self.max_windows)]
+        get_metrics().observe('evidence_windows', len(starts))
+
+        return [encoded_evidence[start:start + window_size] for start in starts]
+
+    def _encode_pairs(self, sample: Dict):
+        # One list of input_ids per candidate: the truncated evidence, or its best windows when windowed.
+        # Handle evidence: encode once and reuse it for every candidate
+        encoded_evidence = self.tokenizer.encode(sample['evidence'], add_special_tokens=False)[:-1]
+        encoded_corrections = [self.tokenizer.encode(correction, add_special_tokens=False)[1:] for correction in sample['candidate']]
+
+        # Ensure combined length is within the maximum allowed
+        max_model_length = self.tokenizer.model_max_length
+        max_length = max_model_length - 3
+
+        windows = [encoded_evidence]
+        if self.window_size and encoded_corrections:
+            # Clamp the windows to the room left by the longest candidate, so none loses its tail
+            room = max_length - max(len(encoded_correction) for encoded_correction in encoded_corrections)
+            windows = self._evidence_windows(encoded_evidence, max(1, min(self.window_size, room)))
+        window_tokens = [set(window) for window in windows]
+
+        pairs = []
+        for encoded_correction in encoded_corrections:
+            if len(windows) > 1 and len(encoded_evidence) > max_length - len(encoded_correction):
+                # Lexical preselection: the windows sharing the most tokens with the candidate
+                correction_tokens = set(encoded_correction)
+                overlaps = [len(tokens & correction_tokens) for tokens in window_tokens]
+                selected = sorted(range(len(windows)), key=lambda i: -overlaps[i])[:self.windows_per_candidate]
+                contexts = [windows[i] for i in sorted(selected)]
+            else:
+                contexts = [encoded_evidence]
+
+            candidate_pairs = []
+            for context in contexts:
+                encoded_ctx_truncated = context[:max_length - len(encoded_correction)]
+                input_ids = [self.tokenizer.cls_token_id] + encoded_ctx_truncated + [self.tokenizer.sep_token_id] + encoded_correction + [self.tokenizer.sep_token_id]
+                candidate_pairs.append(input_ids)
+            pairs.append(candidate_pairs)
+
+        return pairs
+
+    def _score_pairs(self, pairs: List[List[int]]):
+        # Sort by length so each batch is padded to a similar length
+        order = sorted(range(len(pairs)), key=lambda i: len(pairs[i]))
+        scores = [0.0] * len(pairs)
+
+        with torch.inference_mode():
+            for start in range(0, len(order), self.batch_size):
+                batch_indices = order[start:start + self.batch_size]
+                max_length = max(len(pairs[i]) for i in batch_indices)
+
+                # Right-pad input_ids and build attention_mask
+                input_ids = torch.full((len(batch_indices), max_length), self.tokenizer.pad_token_id, dtype=torch.long)
+                attention_mask = torch.zeros((len(batch_indices), max_length), dtype=torch.long)
+                for row, i in enumerate(batch_indices):
+                    input_ids[row, :len(pairs[i])] = torch.LongTensor(pairs[i])
+                    attention_mask[row, :len(pairs[i])] = 1
+
+                # Compute entailment probabilities for the whole batch
+                inputs = {"input_ids": input_ids.to(self.device), "attention_mask": attention_mask.to(self.device)}
                 logits = self.model(**inputs).logits
-                probs = torch.nn.Softmax(dim=1)(logits)
-                entailment_prob = probs[0][0].item()  # Get entailment probability
-                current_entailment_scores.append(entailment_prob)
+                get_metrics().inc('forward_passes', model='entailment')
+                get_metrics().observe('forward_batch_size', len(batch_indices), model='entailment')
+                probs = torch.softmax(logits, dim=1)[:, 0].tolist()  # Get entailment probability
+                for i, prob in zip(batch_indices, probs):
+                    scores[i] = prob
 
-            if len(current_entailment_scores):
-                sample['entailment_score'].append(max(current_entailment_scores))
+        return scores
 
+    def _rank_candidates(self, sample: Dict):
         # Combine all scores
         if sample['entailment_score']:
             sample['final_score'] = np.array(sample['entailment_score']) + np.array(sample['rouge_score']) / 50
             argmax = np.argmax(sample['final_score'])
             sample['correction'] = sample['candidate'][argmax]
         else:
+            sample['final_score'] = np.array([])
             sample['correction'] = sample['input_claim']
 
         # Handle value type of final score:
@@ -85,6 +172,63 @@ class EntailmentModel:
 
         return sample
 
+    def compute_claim_entailment(self, evidence: str, claim: str):
+        # Entailment probability of a single claim given the evidence
+        return self.batch_compute_claim_entailment([evidence], [claim])[0]
+
+    def batch_compute_claim_entailment(self, evidences: List[str], claims: List[str]):
+        # Entailment probability of each claim given its evidence, all pairs in shared padded batches
+        pairs = []
+        owners = []
+        for idx, (evidence, claim) in enumerate(zip(evidences, claims)):
+            claim_pairs = self._encode_pairs({'evidence': evidence, 'candidate': [claim]})[0]
+            pairs += claim_pairs
+            owners += [idx] * len(claim_pairs)
+
+        scores = [0.0] * len(claims)
+        for idx, score in zip(owners, self._score_pairs(pairs) if pairs else []):
+            scores[idx] = max(scores[idx], score)
+        return scores
+
+    def compute_entailment(self, sample: Dict):
+        return self.batch_compute_entailment([sample])[0]
+
+    def batch_compute_entailment(self, samples: List[Dict]):
+        for sample in samples:
+            sample['candidate'] = sample['candidate'] + [sample['input_claim']]  # Add input claim to handle verified claims
+
+        # Compute ROUGE between input claim and candidates, the claim is tokenized once per sample
+        rouge_scores = self.lexical_scorer.batch_score(
+            [sample['input_claim'] for sample in samples],
+            [sample['candidate'] for sample in samples]
+        )
+
+        # Collect (evidence, candidate) pairs of all samples
+        pairs = []
+        owners = []
+        for idx, sample in enumerate(samples):
+            sample['rouge_score'] = rouge_scores[idx]['rouge1'].tolist()
+            sample['entailment_score'] = [0.0] * len(sample['candidate'])
+
+            # The input claim was already scored when the cascade verified it
+            known = sample.get('input_entailment_score')
+            candidates = sample['candidate']
+            if known is not None:
+                sample['entailment_score'][-1] = known
+                candidates = candidates[:-1]
+
+            for candidate_idx, candidate_pairs in enumerate(self._encode_pairs({**sample, 'candidate': candidates})):
+                pairs += candidate_pairs
+                owners += [(idx, candidate_idx)] * len(candidate_pairs)
+
+        # Compute entailment scores in padded batches, a candidate scored on several windows keeps the max
+        scores = self._score_pairs(pairs) if pairs else []
+        for (idx, candidate_idx), score in zip(owners, scores):
+            entailment_score = samples[idx]['entailment_score']
+            entailment_score[candidate_idx] = max(entailment_score[candidate_idx], score)
+
+        return [self._rank_candidates(sample) for sample in samples]
+
 
 if __name__ == "__main__":
      # Input
@@ -0,0 +1,74 @@
+from abc import ABC, abstractmethod
+from typing import Dict, List
+from utils.llm_cache import LLMCache
+from utils.llm_scheduler import LLMScheduler, get_scheduler
+from utils.metrics import get_metrics
+
+class GenerationBackend(ABC):
+    # Turns chat requests (lists of messages) into one output text each, in request order
+    @abstractmethod
+    def generate(self, requests: List[List[Dict]]) -> List[str]:
+        ...
+
+
+class TogetherBackend(GenerationBackend):
+    def __init__(self, model_name="mistralai/Mixtral-8x7B-Instruct-v0.1", cache: LLMCache = None, scheduler: LLMScheduler = None):
+        self.model_name = model_name
+        self.cache = cache
+        # Requests of every generator go through one shared, rate-limited scheduler
+        self.scheduler = scheduler or get_scheduler()
+
+    def generate(self, requests: List[List[Dict]]):
+        # Submit all requests at once, the scheduler keeps them within the rate limits
+        return self.scheduler.complete_many(self.model_name, requests, cache=self.cache)
+
+
+class LocalSeq2SeqBackend(GenerationBackend):
+    def __init__(self, model_name: str, batch_size=16, num_beams=1, max_new_tokens=64, max_input_length=512):
+        # Vietnamese seq2seq checkpoint (e.g. a ViT5 fine-tuned for generation), greedy when num_beams is 1
+        import torch
+        from transformers import AutoTokenizer, AutoModelForSeq2SeqLM
+
+        self.model_name = model_name
+        self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self.model = AutoModelForSeq2SeqLM.from_pretrained(model_name).to(self.device).eval()
+
+        # Number of requests generated per forward pass
+        self.batch_size = batch_size
+        self.num_beams = num_beams
+        self.max_new_tokens = max_new_tokens
+        self.max_input_length = max_input_length
+
+    def format_input(self, messages: List[Dict]):
+        # Seq2seq checkpoints are not chat models: the user turn, without its indentation, is the input
+        return "\n".join(line.strip() for line in messages[-1]["content"].strip().splitlines())
+
+    def generate(self, requests: List[List[Dict]]):
+        import torch
+
+        texts = [self.format_input(messages) for messages in requests]
+
+        # Sort by length so each batch is padded to a similar length
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        outputs = [None] * len(texts)
+        metrics = get_metrics()
+        for start in range(0, len(order), self.batch_size):
+            batch = order[start:start + self.batch_size]
+            inputs = self.tokenizer(
+                [texts[i] for i in batch],
+                padding=True,
+                truncation=True,
+                max_length=self.max_input_length,
+                return_tensors="pt"
+            ).to(self.device)
+
+            with torch.inference_mode():
+                generated = self.model.generate(**inputs, num_beams=self.num_beams, max_new_tokens=self.max_new_tokens)
+            metrics.inc('forward_passes', model='generation')
+            metrics.observe('forward_batch_size', len(batch), model='generation')
+
+            for i, output in zip(batch, self.tokenizer.batch_decode(generated, skip_special_tokens=True)):
+                outputs[i] = output
+
+        return outputs
@@ -0,0 +1,137 @@
+from typing import Dict, List
+import numpy as np
+import re
+import unicodedata
+
+ROUGE_METRICS = ('rouge1', 'rouge2', 'rougeL')
+
+def tokenize(text):
+    # Vietnamese-aware tokens: NFC-normalized, lowercased syllables keeping their diacritics
+    return re.findall(r"\w+", unicodedata.normalize("NFC", text).lower())
+
+def ngrams(tokens, n):
+    return [tuple(tokens[i:i + n]) for i in range(len(tokens) - n + 1)]
+
+def f_measure(overlap, prediction_total, reference_total):
+    # Element-wise F1 of precision overlap / prediction_total and recall overlap / reference_total
+    precision = np.divide(overlap, prediction_total, out=np.zeros_like(overlap), where=prediction_total > 0)
+    recall = np.divide(overlap, reference_total, out=np.zeros_like(overlap), where=reference_total > 0)
+    return np.divide(2 * precision * recall, precision + recall, out=np.zeros_like(overlap), where=precision + recall > 0)
+
+def lcs_length(reference_masks, reference_length, tokens):
+    # Bit-parallel LCS length (Hyyrö): one big-integer update per candidate token
+    full = (1 << reference_length) - 1
+    v = full
+    for token in tokens:
+        u = v & reference_masks.get(token, 0)
+        v = ((v + u) | (v - u)) & full
+    return reference_length - bin(v).count("1")
+
+class LexicalScorer:
+    def __init__(self, metrics=('rouge1',)):
+        for metric in metrics:
+            if metric not in ROUGE_METRICS:
+                raise ValueError(f"Unknown metric {metric}, expected one of {ROUGE_METRICS}")
+        self.metrics = tuple(metrics)
+
+    def score(self, reference: str, candidates: List[str]) -> Dict[str, np.ndarray]:
+        return self.batch_score([reference], [candidates])[0]
+
+    def batch_score(self, references: List[str], candidate_lists: List[List[str]]) -> List[Dict[str, np.ndarray]]:
+        # F-measure of every candidate against its sample's reference, one array per metric and sample
+        reference_tokens = [tokenize(reference) for reference in references]
+        candidate_tokens = [[tokenize(candidate) for candidate in candidates] for candidates in candidate_lists]
+        sizes = [len(candidates) for candidates in candidate_lists]
+
+        scores = {}
+        for metric in self.metrics:
+            if metric == 'rougeL':
+                scores[metric] = self._rouge_l(reference_tokens, candidate_tokens)
+            else:
+                scores[metric] = self._rouge_n(reference_tokens, candidate_tokens, int(metric[-1]))
+
+        # Split the flat arrays back per sample
+        bounds = np.cumsum([0] + sizes)
+        return [
+            {metric: values[bounds[i]:bounds[i + 1]] for metric, values in scores.items()}
+            for i in range(len(sizes))
+        ]
+
+    def _rouge_n(self, reference_tokens, candidate_tokens, n):
+        # Columns are the n-grams of each reference, counts are clipped by the reference counts
+        columns = {}
+        reference_counts = []
+        reference_totals = []
+        for sample_idx, tokens in enumerate(reference_tokens):
+            grams = ngrams(tokens, n)
+            reference_totals.append(len(grams))
+            for gram in grams:
+                key = (sample_idx, gram)
+                if key not in columns:
+                    columns[key] = len(columns)
+                    reference_counts.append(0)
+                reference_counts[columns[key]] += 1
+
+        rows = []
+        cols = []
+        prediction_totals = []
+        row_references = []
+        for sample_idx, candidates in enumerate(candidate_tokens):
+            for tokens in candidates:
+                row = len(prediction_totals)
+                grams = ngrams(tokens, n)
+                prediction_totals.append(len(grams))
+                row_references.append(reference_totals[sample_idx])
+                for gram in grams:
+                    col = columns.get((sample_idx, gram))
+                    if col is not None:
+                        rows.append(row)
+                        cols.append(col)
+
+        num_rows = len(prediction_totals)
+        overlap = np.zeros(num_rows, dtype=np.float64)
+        if rows:
+            # Count each (candidate, n-gram) pair, clip by the reference count and sum per candidate
+            pairs, counts = np.unique(np.stack([rows, cols], axis=1), axis=0, return_counts=True)
+            clipped = np.minimum(counts, np.asarray(reference_counts)[pairs[:, 1]])
+            overlap = np.bincount(pairs[:, 0], weights=clipped, minlength=num_rows).astype(np.float64)
+
+        return f_measure(overlap, np.asarray(prediction_totals, dtype=np.float64), np.asarray(row_references, dtype=np.float64))
+
+    def _rouge_l(self, reference_tokens, candidate_tokens):
+        overlap = []
+        prediction_totals = []
+        reference_totals = []
+        for tokens, candidates in zip(reference_tokens, candidate_tokens):
+            # Position bitmasks of every reference token, built once per reference
+            masks = {}
+            for i, token in enumerate(tokens):
+                masks[token] = masks.get(token, 0) | (1 << i)
+            for candidate in candidates:
+                overlap.append(lcs_length(masks, len(tokens), candidate))
+                prediction_totals.append(len(candidate))
+                reference_totals.append(len(tokens))
+
+        return f_measure(
+            np.asarray(overlap, dtype=np.float64),
+            np.asarray(prediction_totals, dtype=np.float64),
+            np.asarray(reference_totals, dtype=np.float64)
+        )
+
+
+if __name__ == "__main__":
+    # Input
+    input_claim = "SAWACO thông báo tạm ngưng cung cấp nước để thực hiện công tác bảo trì, bảo dưỡng định kỳ Nhà máy nước Tân Hiệp, thời gian thực hiện dự kiến từ 12 giờ ngày 25-3 (thứ bảy) đến 4 giờ ngày 26-3 (chủ nhật)."
+    candidates = [
+        "SAWACO thông báo tạm ngưng cấp nước để thực hiện công tác bảo trì định kỳ Nhà máy nước Tân Hiệp, thời gian thực hiện dự kiến từ 22 giờ ngày 25-3 (thứ bảy) đến 4 giờ ngày 26-3 (chủ nhật).",
+        "SAWACO thông báo tạm ngưng cung cấp nước để thực hiện công tác bảo dưỡng định kỳ Nhà máy nước Tân Hiệp, thời gian thực hiện dự kiến từ 12 giờ ngày 25-3 (thứ bảy) đến 4 giờ ngày 26-3 (chủ nhật)."
+    ]
+
+    # Lexical scoring
+    scorer = LexicalScorer(metrics=ROUGE_METRICS)
+    scores = scorer.score(input_claim, candidates)
+
+    for i in range(len(candidates)):
+        print(f"\nCandidate: {candidates[i]}")
+        for metric in ROUGE_METRICS:
+            print(f"{metric}: {scores[metric][i]:.4f}")
@@ -1,72 +1,73 @@
-import nest_asyncio
-nest_asyncio.apply()
-
-from together import AsyncTogether
-import asyncio
-from typing import Dict
-import time
+from typing import Dict, List
+from model.tasks.generation_backend import GenerationBackend, TogetherBackend
+from utils.llm_cache import LLMCache
+from utils.llm_scheduler import LLMScheduler
+from utils.packed_prompting import generate_packed, numbered
 
 class QAtoClaimGenerator:
-    def __init__(self, model_name="mistralai/Mixtral-8x7B-Instruct-v0.1"):
-        self.model_name = model_name
-        self.api_token = ""
-        self.client = AsyncTogether(api_key=self.api_token)
-        self.max_requests_per_second = 5
-        self.semaphore = asyncio.Semaphore(self.max_requests_per_second)
+    def __init__(self, model_name="mistralai/Mixtral-8x7B-Instruct-v0.1", cache: LLMCache = None, scheduler: LLMScheduler = None,
+                 pack_size=1, backend: GenerationBackend = None):
+        # Together API through the shared scheduler unless another backend is given
+        self.backend = backend or TogetherBackend(model_name, cache=cache, scheduler=scheduler)
+        # Question-answer pairs per request, above 1 the model answers with a list of claims
+        self.pack_size = pack_size
         self.prompt = f"""
                 Nhiệm vụ của bạn là tạo ra một câu tuyên bố từ cặp câu hỏi và câu trả lời cho trước. Câu tuyên bố phải mang đầy đủ nội dung của cả câu hỏi và câu trả lời.
                 Bằng cách kết hợp câu hỏi và câu trả lời, hãy tạo ra một câu tuyên bố duy nhất.
         """
+        self.packed_prompt = """
+                Nhiệm vụ của bạn là tạo ra một câu tuyên bố cho mỗi cặp câu hỏi và câu trả lời được đánh số cho trước. Mỗi câu tuyên bố phải mang đầy đủ nội dung của cả câu hỏi và câu trả lời tương ứng.
+                Bằng cách kết hợp từng cặp câu hỏi và câu trả lời, hãy tạo ra một câu tuyên bố duy nhất cho cặp đó.
+                Chỉ trả về kết quả là một danh sách JSON các câu tuyên bố, theo đúng thứ tự của các cặp.
+        """
 
-    async def async_chat_completion(self, requests, outputs):
-        tasks = [self._rate_limited_request(messages, outputs) for messages in requests]
-        await asyncio.gather(*tasks)
-
-    async def _rate_limited_request(self, messages, outputs):
-        # Use the semaphore to enforce rate limiting
-        async with self.semaphore:
-            response = await self.client.chat.completions.create(
-                model=self.model_name,
-                messages=messages,
-            )
-            output = response.choices[0].message.content
-            output = output.strip()
-            if output.startswith('"') and output.endswith('"'):
-                output = output[1:-1]
-            if len(output) > 0:
-                outputs.append(output)
-
-    def generate_claims(self, sample: Dict):
-        questions = sample["generated_question"]
-        answers = sample["answer"]
+    def _postprocess(self, output):
+        output = output.strip()
+        if output.startswith('"') and output.endswith('"'):
+            output = output[1:-1]
+        return output
 
-        sample["candidate"] = []
-        requests = []
-        for question, answer in zip(questions, answers):
-            # Format input
-            user_content = f"""
+    def _build_request(self, question: str, answer: str):
+        # Format input, kept byte for byte so cached generations stay valid
+        user_content = f"""
                     Câu hỏi: {question}
                     Trả lời: {answer}
                     Câu tuyên bố:
             """
-            requests.append([
-                {"role": "system", "content": self.prompt},
-                {"role": "user", "content": user_content},
-            ])
+        return [
+            {"role": "system", "content": self.prompt},
+            {"role": "user", "content": user_content},
+        ]
+
+    def _build_packed_request(self, pairs: List[tuple]):
+        pairs = [f"Câu hỏi: {question} | Trả lời: {answer}" for question, answer in pairs]
+        user_content = f"""
+{numbered(pairs)}
+                    Danh sách JSON gồm {len(pairs)} câu tuyên bố:
+            """
+        return [
+            {"role": "system", "content": self.packed_prompt},
+            {"role": "user", "content": user_content},
+        ]
+
+    def generate_claims(self, sample: Dict):
+        return self.batch_generate_claims([sample])[0]
 
-        outputs = []
-        # Use a running event loop
-        loop = asyncio.get_event_loop()
-        if loop.is_running():
-            coroutine = self.async_chat_completion(requests, outputs)
-            task = asyncio.create_task(coroutine)
-            loop.run_until_complete(task)
-        else:
-            asyncio.run(self.async_chat_completion(requests, outputs))
+    def batch_generate_claims(self, samples: List[Dict]):
+        # Generate for all samples at once, so the backend can batch or overlap the requests
+        outputs = generate_packed(
+            self.backend,
+            [list(zip(sample["generated_question"], sample["answer"])) for sample in samples],
+            lambda idx, pair: self._build_request(*pair),
+            lambda idx, pairs: self._build_packed_request(pairs),
+            self.pack_size
+        )
 
-        sample["candidate"] = outputs
+        for sample, sample_outputs in zip(samples, outputs):
+            sample_outputs = [self._postprocess(output) for output in sample_outputs]
+            sample["candidate"] = [output for output in sample_outputs if len(output) > 0]
 
-        return sample
+        return samples
 
 
 if __name__ == "__main__":
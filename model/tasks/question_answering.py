@@ -1,10 +1,13 @@
 from transformers import AutoTokenizer, AutoModelForQuestionAnswering, pipeline
-from typing import Dict
+from typing import Dict, List
+from utils.metrics import get_metrics
+from utils.onnx_backend import load_onnx_model
 import torch
 
 class QuestionAnswering:
-    def __init__(self, model_name="PhucDanh/vit5-fine-tuning-for-question-answering"):
-        self.device = "cuda" if torch.cuda.is_available() else "cpu"
+    def __init__(self, model_name="PhucDanh/vit5-fine-tuning-for-question-answering", batch_size=16,
+                 backend="torch", onnx_cache_dir=None, quantize=True, num_threads=None):
+        self.device = "cuda" if torch.cuda.is_available() and backend == "torch" else "cpu"
         self.tokenizer = AutoTokenizer.from_pretrained(model_name)
 
         # When use PhucDanh/vit5-fine-tuning-for-question-answering -> Add this below
@@ -13,17 +16,84 @@ class QuestionAnswering:
         except:
             pass
 
-        self.model = AutoModelForQuestionAnswering.from_pretrained(model_name).to(self.device)
+        if backend == "onnx":
+            # ONNX Runtime on CPU, the graph is exported on first use and cached on disk
+            from optimum.onnxruntime import ORTModelForQuestionAnswering
+            self.model = load_onnx_model(
+                ORTModelForQuestionAnswering,
+                lambda: AutoModelForQuestionAnswering.from_pretrained(model_name),
+                self.tokenizer,
+                model_name,
+                output_names=["start_logits", "end_logits"],
+                cache_dir=onnx_cache_dir,
+                quantize=quantize,
+                num_threads=num_threads,
+                model_kwargs={"use_cache": False}
+            )
+        else:
+            self.model = AutoModelForQuestionAnswering.from_pretrained(model_name).to(self.device)
         self.pipeline = pipeline("question-answering", model=self.model, tokenizer=self.tokenizer, device=0 if self.device == "cuda" else -1)
+        self._count_forward_passes()
+
+        # Number of (question, evidence) pairs answered per forward pass
+        self.batch_size = batch_size
+
+    def _count_forward_passes(self):
+        # Count at the model call: long evidence is split into several overflow features,
+        # so the real forward passes and batch sizes differ from the number of questions
+        forward = self.pipeline._forward
+
+        def counted_forward(model_inputs, *args, **kwargs):
+            metrics = get_metrics()
+            metrics.inc('forward_passes', model='question_answering')
+            metrics.observe('forward_batch_size', len(model_inputs['input_ids']), model='question_answering')
+            return forward(model_inputs, *args, **kwargs)
+
+        self.pipeline._forward = counted_forward
 
     def answer_question(self, sample: Dict):
-        questions = sample['generated_question']
-        sample['answer'] = []
-        for question in questions:
-            answer = self.pipeline(question=question, context=sample['evidence'])
-            sample['answer'].append(answer['answer'])
+        return self.batch_answer_question([sample])[0]
+
+    def batch_answer_question(self, samples: List[Dict]):
+        # Flatten (question, evidence) pairs of all samples
+        questions = []
+        contexts = []
+        owners = []
+        for idx, sample in enumerate(samples):
+            sample['answer'] = []
+            sample['answer_score'] = []
+            sample['answer_start'] = []
+            sample['answer_end'] = []
+            for question in sample['generated_question']:
+                questions.append(question)
+                contexts.append(sample['evidence'])
+                owners.append(idx)
+
+        if not questions:
+            return samples
+
+        # Sort by length so the pipeline pads each batch to a similar length
+        order = sorted(range(len(questions)), key=lambda i: len(questions[i]) + len(contexts[i]))
+        answers = self.pipeline(
+            question=[questions[i] for i in order],
+            context=[contexts[i] for i in order],
+            batch_size=self.batch_size
+        )
+        if isinstance(answers, dict):
+            answers = [answers]
+
+        # Map answers back to their questions in the original order
+        ordered_answers = [None] * len(questions)
+        for i, answer in zip(order, answers):
+            ordered_answers[i] = answer
+        # Keep the confidence and the character span of each answer in the evidence
+        for idx, answer in zip(owners, ordered_answers):
+            samples[idx]['answer'].append(answer['answer'])
+            samples[idx]['answer_score'].append(float(answer['score']))
+            samples[idx]['answer_start'].append(int(answer['start']))
+            samples[idx]['answer_end'].append(int(answer['end']))
 
-        return sample
+        return samples
 
 
 if __name__ == "__main__":
@@ -1,18 +1,16 @@
-import nest_asyncio
-nest_asyncio.apply()
-
-from together import AsyncTogether
-import asyncio
-from typing import Dict
-import time
+from typing import Dict, List
+from model.tasks.generation_backend import GenerationBackend, TogetherBackend
+from utils.llm_cache import LLMCache
+from utils.llm_scheduler import LLMScheduler
+from utils.packed_prompting import generate_packed, numbered
 
 class QuestionGenerator:
-    def __init__(self, model_name="mistralai/Mixtral-8x7B-Instruct-v0.1"):
-        self.model_name = model_name
-        self.api_token = ""
-        self.client = AsyncTogether(api_key=self.api_token)
-        self.max_requests_per_second = 5
-        self.semaphore = asyncio.Semaphore(self.max_requests_per_second)
+    def __init__(self, model_name="mistralai/Mixtral-8x7B-Instruct-v0.1", cache: LLMCache = None, scheduler: LLMScheduler = None,
+                 pack_size=1, backend: GenerationBackend = None):
+        # Together API through the shared scheduler unless another backend is given
+        self.backend = backend or TogetherBackend(model_name, cache=cache, scheduler=scheduler)
+        # Claim units per request, above 1 the model answers with a list of questions
+        self.pack_size = pack_size
         self.prompt = """
             Bạn được cung cấp một 'ngữ cảnh' và một 'thông tin' được lấy từ ngữ cảnh.
             Nhiệm vụ của bạn là tạo ra duy nhất một câu hỏi bằng tiếng Việt từ 'ngữ cảnh' và 'thông tin' đó.
@@ -21,57 +19,72 @@ class QuestionGenerator:
             2. Nếu bạn trả lời cho câu hỏi tạo ra, câu trả lời đó là 'thông tin' được cung cấp.
             Chỉ trả về kết quả là 1 câu hỏi.
         """
+        self.packed_prompt = """
+            Bạn được cung cấp một 'ngữ cảnh' và một danh sách 'thông tin' được đánh số, mỗi 'thông tin' được lấy từ ngữ cảnh.
+            Nhiệm vụ của bạn là tạo ra duy nhất một câu hỏi bằng tiếng Việt cho mỗi 'thông tin', từ 'ngữ cảnh' và 'thông tin' đó.
+            Mỗi câu hỏi tạo ra thỏa mãn hai yếu tố sau:
+            1. Câu hỏi được tạo ra phải xuất phát từ 'ngữ cảnh'.
+            2. Nếu bạn trả lời cho câu hỏi tạo ra, câu trả lời đó là 'thông tin' tương ứng.
+            Chỉ trả về kết quả là một danh sách JSON các câu hỏi, theo đúng thứ tự của các 'thông tin'.
+        """
 
-    async def async_chat_completion(self, requests, outputs):
-        tasks = [self._rate_limited_request(messages, outputs) for messages in requests]
-        await asyncio.gather(*tasks)
-
-    async def _rate_limited_request(self, messages, outputs):
-        # Use the semaphore to enforce rate limiting
-        async with self.semaphore:
-            response = await self.client.chat.completions.create(
-                model=self.model_name,
-                messages=messages,
-            )
-            output = response.choices[0].message.content
-            output = output.strip()
-            if output.startswith('"') and output.endswith('"'):
-                output = output[1:-1]
-            if len(output) > 0:
-                outputs.append(output)
-
-    def generate_questions(self, sample: Dict):
-        input_claim = sample["input_claim"]
-        claim_answer = sample["claim_answer"]
+    def _postprocess(self, output):
+        output = output.strip()
+        if output.startswith('"') and output.endswith('"'):
+            output = output[1:-1]
+        return output
 
-        sample["generated_question"] = []
-        requests = []
-        for answer in claim_answer:
-            # Format input
-            user_content = f"""
+    def _build_request(self, input_claim: str, answer: str):
+        # Format input, kept byte for byte so cached generations stay valid
+        user_content = f"""
                 Hãy tạo ra 1 câu hỏi từ ngữ cảnh và thông tin sau:
                 Ngữ cảnh: {input_claim}
                 Thông tin: {answer}
             """
 
-            requests.append([
-                {"role": "system", "content": self.prompt},
-                {"role": "user", "content": user_content},
-            ])
-        outputs = []
+        return [
+            {"role": "system", "content": self.prompt},
+            {"role": "user", "content": user_content},
+        ]
+
+    def _build_packed_request(self, input_claim: str, answers: List[str]):
+        # Several claim units of one claim share the prompt and the context
+        user_content = f"""
+            Hãy tạo ra {len(answers)} câu hỏi, mỗi câu hỏi cho một thông tin, từ ngữ cảnh và các thông tin sau:
+            Ngữ cảnh: {input_claim}
+            Thông tin:
+{numbered(answers)}
+        """
+
+        return [
+            {"role": "system", "content": self.packed_prompt},
+            {"role": "user", "content": user_content},
+        ]
+
+    def generate_questions(self, sample: Dict):
+        return self.batch_generate_questions([sample])[0]
 
-        # Use a running event loop
-        loop = asyncio.get_event_loop()
-        if loop.is_running():
-            coroutine = self.async_chat_completion(requests, outputs)
-            task = asyncio.create_task(coroutine)
-            loop.run_until_complete(task)
-        else:
-            asyncio.run(self.async_chat_completion(requests, outputs))
+    def batch_generate_questions(self, samples: List[Dict]):
+        # Generate for all samples at once, so the backend can batch or overlap the requests
+        outputs = generate_packed(
+            self.backend,
+            [sample["claim_answer"] for sample in samples],
+            lambda idx, answer: self._build_request(samples[idx]["input_claim"], answer),
+            lambda idx, answers: self._build_packed_request(samples[idx]["input_claim"], answers),
+            self.pack_size
+        )
 
-        sample["generated_question"] = outputs
+        for sample, sample_outputs in zip(samples, outputs):
+            # Keep the claim unit each question was generated from, empty outputs are dropped
+            kept = [
+                (question, answer)
+                for question, answer in zip((self._postprocess(output) for output in sample_outputs), sample["claim_answer"])
+                if len(question) > 0
+            ]
+            sample["generated_question"] = [question for question, _ in kept]
+            sample["question_source"] = [answer for _, answer in kept]
 
-        return sample
+        return samples
 
 
 if __name__ == "__main__":
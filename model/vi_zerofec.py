@@ -1,73 +1,450 @@
-from model.tasks.claim_answer_generation import ClaimAnswerGenerator
-from model.tasks.question_generation import QuestionGenerator
-from model.tasks.question_answering import QuestionAnswering
-from model.tasks.qa_to_claim import QAtoClaimGenerator
-from model.tasks.correction_scoring import EntailmentModel
-import time
-from typing import Dict, List
+from model.stage_executor import StageExecutor
+from model.tasks.generation_backend import GenerationBackend
+from utils.checkpoint import JsonlWriter, load_processed_ids, open_writer, sample_id
+from utils.llm_cache import LLMCache
+from utils.llm_scheduler import LLMScheduler
+from utils.metrics import get_metrics
+from collections import deque
+from concurrent.futures import Future
+import itertools
+import logging
+import os
+import threading
+from typing import Dict, Iterable, List
 from tqdm import tqdm
-import json
+
+logger = logging.getLogger(__name__)
+
+# Per-sample fan-out recorded after each stage: metric name and sample field
+STAGE_FANOUT = {
+    'ClaimAnswerGenerator': ('claim_units', 'claim_answer'),
+    'QuestionGenerator': ('questions', 'generated_question'),
+    'QuestionAnswering': ('answers', 'answer'),
+    'AnswerFiltering': ('kept_answers', 'answer'),
+    'CandidateGenerator': ('candidates', 'candidate'),
+}
+
+# Tiny input used to warm up the local models
+WARMUP_SAMPLE = {
+    'input_claim': 'Hà Nội là thủ đô của Việt Nam.',
+    'evidence': 'Hà Nội là thủ đô của nước Cộng hòa xã hội chủ nghĩa Việt Nam.',
+    'generated_question': ['Thủ đô của Việt Nam là gì?'],
+    'candidate': [],
+}
 
 class Vi_ZeroFEC:
-    def __init__(self) -> None:
-        self.claim_answer_generator = ClaimAnswerGenerator()
-        self.question_generator = QuestionGenerator()
-        self.question_answering = QuestionAnswering()
-        self.candidate_generator = QAtoClaimGenerator()
-        self.score_ranking = EntailmentModel()
+    def __init__(self, stage_workers: Dict[str, int] = None, queue_size=8, llm_cache: LLMCache = None,
+                 llm_scheduler: LLMScheduler = None, inference_backend="torch", load="eager", warmup=False,
+                 cascade_threshold=None, near_duplicate_threshold=None, llm_pack_size=1,
+                 generation_backend: GenerationBackend = None, local_generation_model: str = None,
+                 evidence_window_size=None, answer_filter_threshold=None, prune_claim_units=False,
+                 max_claim_units=None) -> None:
+        # inference_backend: "torch" or "onnx" for the QA and entailment models
+        self.llm_cache = llm_cache
+        self.llm_scheduler = llm_scheduler
+        # Claim units or question-answer pairs sent per LLM request
+        self.llm_pack_size = llm_pack_size
+        # Question and claim generation: Together API by default, or a given backend,
+        # or a local seq2seq checkpoint shared by both generators
+        self.generation_backend = generation_backend
+        self.local_generation_model = local_generation_model
+        self.inference_backend = inference_backend
+        # Evidence tokens per window when scoring long evidence in overlapping windows, None truncates it
+        self.evidence_window_size = evidence_window_size
+        # Unit selection: drop overlapping claim units and keep at most max_claim_units (None for no budget),
+        # a budget turns selection on
+        self.prune_claim_units = prune_claim_units or max_claim_units is not None
+        self.max_claim_units = max_claim_units
+
+        # Cascade mode: claims entailed by the evidence with at least cascade_threshold are returned as is,
+        # the others are corrected with duplicate candidates removed before scoring
+        self.cascade_threshold = cascade_threshold
+        self.near_duplicate_threshold = near_duplicate_threshold
+
+        # Answer filtering: drop QA pairs under this confidence or whose answer equals its claim unit
+        # before claim generation, None keeps every pair
+        self.answer_filter = None
+        if answer_filter_threshold is not None:
+            from model.tasks.answer_filtering import AnswerFilter
+            self.answer_filter = AnswerFilter(min_score=answer_filter_threshold)
+
+        # Pipelined execution: workers per stage and size of the queues between stages
+        self.stage_workers = stage_workers or {}
+        self.queue_size = queue_size
+
+        # Model loading: "eager" loads all components in parallel and waits for them,
+        # "background" starts loading them in parallel and returns, "lazy" loads each one on first use
+        self.warmup = warmup
+        self._components = {}
+        self._lock = threading.Lock()
+        if load in ("eager", "background"):
+            for name in self._loaders():
+                self._start_loading(name)
+        if load == "eager":
+            for name in self._loaders():
+                self._component(name)
+            print("Finish loading model.")
+
+    def _loaders(self):
+        # Heavy imports (torch, transformers, stanza, together) happen here, not at module import
+        def claim_answer_generator():
+            from model.tasks.claim_answer_generation import ClaimAnswerGenerator
+            return ClaimAnswerGenerator(prune_units=self.prune_claim_units, max_units=self.max_claim_units)
+
+        def generation_backend():
+            if self.generation_backend is not None or self.local_generation_model is None:
+                return self.generation_backend
+            from model.tasks.generation_backend import LocalSeq2SeqBackend
+            return LocalSeq2SeqBackend(self.local_generation_model)
+
+        def question_generator():
+            from model.tasks.question_generation import QuestionGenerator
+            return QuestionGenerator(cache=self.llm_cache, scheduler=self.llm_scheduler, pack_size=self.llm_pack_size,
+                                     backend=self._component('generation_backend'))
+
+        def question_answering():
+            from model.tasks.question_answering import QuestionAnswering
+            return QuestionAnswering(backend=self.inference_backend)
+
+        def candidate_generator():
+            from model.tasks.qa_to_claim import QAtoClaimGenerator
+            return QAtoClaimGenerator(cache=self.llm_cache, scheduler=self.llm_scheduler, pack_size=self.llm_pack_size,
+                                      backend=self._component('generation_backend'))
+
+        def score_ranking():
+            from model.tasks.correction_scoring import EntailmentModel
+            return EntailmentModel(backend=self.inference_backend, window_size=self.evidence_window_size)
+
+        return {
+            'generation_backend': generation_backend,
+            'claim_answer_generator': claim_answer_generator,
+            'question_generator': question_generator,
+            'question_answering': question_answering,
+            'candidate_generator': candidate_generator,
+            'score_ranking': score_ranking,
+        }
+
+    def _warmup(self, name, component):
+        # Run the local models once so the first real sample does not pay for lazy initialization
+        if name == 'claim_answer_generator':
+            component.extract_information_units(dict(WARMUP_SAMPLE))
+        elif name == 'question_answering':
+            component.answer_question(dict(WARMUP_SAMPLE))
+        elif name == 'score_ranking':
+            component.compute_entailment(dict(WARMUP_SAMPLE))
+
+    def _start_loading(self, name):
+        with self._lock:
+            if name in self._components:
+                return self._components[name]
+            future = Future()
+            self._components[name] = future
+
+        def load():
+            try:
+                with get_metrics().timer('model_load_seconds', component=name):
+                    component = self._loaders()[name]()
+                    if self.warmup:
+                        self._warmup(name, component)
+                future.set_result(component)
+            except BaseException as e:
+                future.set_exception(e)
+
+        threading.Thread(target=load, name=f"load-{name}", daemon=True).start()
+        return future
+
+    def _component(self, name):
+        return self._start_loading(name).result()
+
+    @property
+    def claim_answer_generator(self):
+        return self._component('claim_answer_generator')
+
+    @property
+    def question_generator(self):
+        return self._component('question_generator')
+
+    @property
+    def question_answering(self):
+        return self._component('question_answering')
+
+    @property
+    def candidate_generator(self):
+        return self._component('candidate_generator')
+
+    @property
+    def score_ranking(self):
+        return self._component('score_ranking')
+
+    def _instrument(self, step, function):
+        fanout = STAGE_FANOUT.get(step)
+
+        def run(sample):
+            metrics = get_metrics()
+            if not metrics.enabled:
+                return function(sample)
+
+            # Stage latency and the number of items it produced
+            with metrics.timer('stage_seconds', stage=step):
+                sample = function(sample)
+            if fanout is not None:
+                metrics.observe(fanout[0], len(sample[fanout[1]]))
+            return sample
+
+        return run
+
+    def _instrument_batch(self, step, function):
+        fanout = STAGE_FANOUT.get(step)
+
+        def run(samples):
+            metrics = get_metrics()
+            if not metrics.enabled:
+                return function(samples)
+
+            # Latency of the whole batch, its size, and the items produced per sample
+            with metrics.timer('stage_seconds', stage=step):
+                samples = function(samples)
+            metrics.observe('stage_batch_size', len(samples), stage=step)
+            if fanout is not None:
+                for sample in samples:
+                    metrics.observe(fanout[0], len(sample[fanout[1]]))
+            return samples
+
+        return run
 
-        print("Finish loading model.")
+    def _verify_claim(self, sample: Dict):
+        return self._batch_verify_claims([sample])[0]
+
+    def _batch_verify_claims(self, samples: List[Dict]):
+        # Fast path: score the input claims first and skip correction when the evidence supports them
+        scores = self.score_ranking.batch_compute_claim_entailment(
+            [sample['evidence'] for sample in samples],
+            [sample['input_claim'] for sample in samples]
+        )
+        for sample, score in zip(samples, scores):
+            sample['input_entailment_score'] = score
+            if score < self.cascade_threshold:
+                sample['path'] = 'full'
+                continue
+
+            sample['path'] = 'verified'
+            sample['claim_answer'] = []
+            sample['generated_question'] = []
+            sample['answer'] = []
+            sample['candidate'] = [sample['input_claim']]
+            sample['entailment_score'] = [score]
+            sample['rouge_score'] = [self.score_ranking.compute_rouge(sample['input_claim'], sample['input_claim'])]
+            sample['final_score'] = [score + sample['rouge_score'][0] / 50]
+            sample['correction'] = sample['input_claim']
+            get_metrics().inc('cascade_verified')
+        return samples
+
+    def _batch_score_candidates(self, samples: List[Dict]):
+        if self.cascade_threshold is not None:
+            # Cheap lexical filter before the entailment model
+            from model.tasks.correction_scoring import deduplicate_candidates
+            for sample in samples:
+                candidates = deduplicate_candidates(sample['candidate'], sample['input_claim'], self.near_duplicate_threshold)
+                sample['num_dropped_candidates'] = len(sample['candidate']) - len(candidates)
+                sample['candidate'] = candidates
+
+        return self.score_ranking.batch_compute_entailment(samples)
+
+    def _score_candidates(self, sample: Dict):
+        return self._batch_score_candidates([sample])[0]
+
+    @staticmethod
+    def _skip_verified(function):
+        def run(sample):
+            if sample.get('path') == 'verified':
+                return sample
+            return function(sample)
+
+        return run
+
+    @staticmethod
+    def _skip_verified_batch(function):
+        def run(samples):
+            todo = [sample for sample in samples if sample.get('path') != 'verified']
+            if todo:
+                function(todo)
+            return samples
+
+        return run
+
+    def stages(self):
+        # Components are resolved per call, so building the stages does not load any model
+        stages = [
+            ('ClaimAnswerGenerator', lambda sample: self.claim_answer_generator.extract_information_units(sample)),  # Step 1: Claim Answer Generator
+            ('QuestionGenerator', lambda sample: self.question_generator.generate_questions(sample)),  # Step 2: Question Generation
+            ('QuestionAnswering', lambda sample: self.question_answering.answer_question(sample)),  # Step 3: Question Answering
+            ('CandidateGenerator', lambda sample: self.candidate_generator.generate_claims(sample)),  # Step 4: Candidate Claim Generation
+            ('ScoreRanking', self._score_candidates),  # Step 5: Score Ranking
+        ]
+        if self.answer_filter is not None:
+            # Step 3b: Answer filtering before claim generation
+            stages.insert(3, ('AnswerFiltering', self.answer_filter.filter_answers))
+        stages = [(step, self._instrument(step, function)) for step, function in stages]
+        if self.cascade_threshold is not None:
+            # Step 0: Verification of the input claim, verified samples skip the other steps
+            verification = ('Verification', self._instrument('Verification', self._verify_claim))
+            stages = [verification] + [(step, self._skip_verified(function)) for step, function in stages]
+
+        return stages
+
+    def batch_stages(self):
+        # Batched counterparts of stages(): each function takes and returns a list of samples,
+        # so concurrent requests share Stanza, QA and entailment forward passes
+        stages = [
+            ('ClaimAnswerGenerator', lambda samples: self.claim_answer_generator.batch_extract_information_units(samples)),
+            ('QuestionGenerator', lambda samples: self.question_generator.batch_generate_questions(samples)),
+            ('QuestionAnswering', lambda samples: self.question_answering.batch_answer_question(samples)),
+            ('CandidateGenerator', lambda samples: self.candidate_generator.batch_generate_claims(samples)),
+            ('ScoreRanking', self._batch_score_candidates),
+        ]
+        if self.answer_filter is not None:
+            stages.insert(3, ('AnswerFiltering', self.answer_filter.batch_filter_answers))
+        stages = [(step, self._instrument_batch(step, function)) for step, function in stages]
+        if self.cascade_threshold is not None:
+            verification = ('Verification', self._instrument_batch('Verification', self._batch_verify_claims))
+            stages = [verification] + [(step, self._skip_verified_batch(function)) for step, function in stages]
+
+        return stages
 
     def correct(self, sample: Dict):
-        # Measure time for each step
-        timings = {}
-
-        # Step 1: Claim Answer Generator
-        start_time = time.time()
-        sample = self.claim_answer_generator.extract_information_units(sample)
-        timings['ClaimAnswerGenerator'] = time.time() - start_time
-
-        # Step 2: Question Generation
-        start_time = time.time()
-        sample = self.question_generator.generate_questions(sample)
-        timings['QuestionGenerator'] = time.time() - start_time
-
-        # Step 3: Question Answering
-        start_time = time.time()
-        sample = self.question_answering.answer_question(sample)
-        timings['QuestionAnswering'] = time.time() - start_time
-
-        # Step 4: Candidate Claim Generation
-        start_time = time.time()
-        sample = self.candidate_generator.generate_claims(sample)
-        timings['CandidateGenerator'] = time.time() - start_time
-
-        # Step 5: Score Ranking
-        start_time = time.time()
-        sample = self.score_ranking.compute_entailment(sample)
-        timings['ScoreRanking'] = time.time() - start_time
-
-        # Print timings for each step
-        print("\nStep-wise Timings:")
-        for step, duration in timings.items():
-            print(f"{step}: {duration:.4f} seconds")
+        # Stage timings and fan-out are recorded in the process-wide metrics
+        with get_metrics().timer('sample_seconds'):
+            for _, function in self.stages():
+                sample = function(sample)
 
         return sample
 
-    def batch_correct(self, samples: List[Dict], output_file: str):
-        result = []
-        for idx, sample in enumerate(tqdm(samples, total=len(samples))):
+    @staticmethod
+    def _run_batch(stages, batch: List[Dict]):
+        try:
+            for _, function in stages:
+                batch = function(batch)
+            return batch, None
+        except Exception as e:
+            return batch, e
+
+    def _correct_batches(self, samples: Iterable[Dict], pipelined: bool, batch_size: int):
+        # Chunks of batch_size samples go through batch_stages(), so Stanza, QA and the entailment model
+        # run on whole chunks. Stages work on copies, and a failed chunk is retried sample by sample
+        pending = deque()
+
+        def chunks():
+            iterator = iter(samples)
+            while True:
+                chunk = list(itertools.islice(iterator, batch_size))
+                if not chunk:
+                    return
+                pending.append(chunk)
+                yield [dict(sample) for sample in chunk]
+
+        stages = self.batch_stages()
+        if pipelined:
+            executor = StageExecutor(stages, concurrency=self.stage_workers, queue_size=self.queue_size)
+            results = executor.run(chunks())
+        else:
+            results = (self._run_batch(stages, chunk) for chunk in chunks())
+
+        for processed, error in results:
+            chunk = pending.popleft()
+            if error is None:
+                for sample in processed:
+                    yield sample, None
+                continue
+
+            logger.warning("Batch of %d samples failed (%r), retrying them one by one", len(chunk), error)
+            for sample in chunk:
+                try:
+                    yield self.correct(dict(sample)), None
+                except Exception as e:
+                    yield sample, e
+
+    def _correct_all(self, samples: Iterable[Dict], pipelined: bool, batch_size: int = None):
+        # Yield (processed_sample, error) pairs in input order
+        if batch_size:
+            yield from self._correct_batches(samples, pipelined, batch_size)
+            return
+
+        if pipelined:
+            executor = StageExecutor(self.stages(), concurrency=self.stage_workers, queue_size=self.queue_size)
+            yield from executor.run(samples)
+            return
+
+        for sample in samples:
             try:
-                # Attempt to process the sample
-                processed_sample = self.correct(sample)
-                result.append(processed_sample)
-                with open(output_file, "a", encoding="utf-8") as f:
-                    json.dump(processed_sample, f, ensure_ascii=False)
-                    f.write("\n")
-                    print(f"Processed and saved sample: {idx}")
+                yield self.correct(sample), None
             except Exception as e:
-                # Log the error and continue
-                print(f"Error processing sample {idx}: {e}")
+                yield sample, e
+
+    def correct_iter(self, samples: Iterable[Dict], pipelined: bool = False, batch_size: int = None):
+        # Yield corrected samples in input order without keeping them, failed samples are logged and skipped.
+        # batch_size: run the batched stages on chunks of this many samples instead of one sample at a time
+        for idx, (sample, error) in enumerate(self._correct_all(samples, pipelined, batch_size)):
+            if error is not None:
+                logger.error("Error processing sample %s: %r", idx, error, exc_info=error)
+                get_metrics().inc('samples', status='failed')
                 continue
-        
+            get_metrics().inc('samples', status='ok')
+            yield sample
+
+    def batch_correct(self, samples: Iterable[Dict], output_file: str, pipelined: bool = False,
+                      resume: bool = True, retry_file: str = None, checkpoint_every=None, keep_results=True,
+                      batch_size: int = None):
+        # samples: a list or any iterable, consumed as the corrector goes so it can be a lazy generator.
+        # output_file: JSONL, or a directory of Parquet parts when it ends with .parquet.
+        # checkpoint_every: records per fsync for JSONL (default 50), per part for Parquet (default 1000).
+        # batch_size: run the batched stages on chunks of this many samples instead of one sample at a time
+        # Skip samples already saved by a previous run
+        processed_ids = load_processed_ids(output_file) if resume else set()
+        skipped = 0
+        # (index, id, input) of the samples sent to the stages, outputs come back in the same order
+        pending = deque()
+
+        def inputs():
+            nonlocal skipped
+            for idx, sample in enumerate(samples):
+                sid = sample_id(sample)
+                if sid in processed_ids:
+                    skipped += 1
+                    continue
+                pending.append((idx, sid, sample))
+                yield {**sample, 'sample_id': sid}
+
+        # Failed samples are saved for a later retry
+        if retry_file is None:
+            retry_file = os.path.splitext(output_file)[0] + ".retry.jsonl"
+        retry_writer = None
+
+        # Without keep_results, processed samples are only written out so memory stays flat
+        result = [] if keep_results else None
+        total = len(samples) if hasattr(samples, "__len__") and not processed_ids else None
+        with open_writer(output_file, checkpoint_every=checkpoint_every) as writer:
+            try:
+                for processed_sample, error in tqdm(self._correct_all(inputs(), pipelined, batch_size), total=total):
+                    idx, sid, sample = pending.popleft()
+                    if error is not None:
+                        # Log the error and continue
+                        logger.error("Error processing sample %s: %r", idx, error, exc_info=error)
+                        get_metrics().inc('samples', status='failed')
+                        if retry_writer is None:
+                            retry_writer = JsonlWriter(retry_file, checkpoint_every=1, mode="w")
+                        retry_writer.write({**sample, 'sample_id': sid, 'error': repr(error)})
+                        continue
+
+                    if keep_results:
+                        result.append(processed_sample)
+                    writer.write(processed_sample)
+                    get_metrics().inc('samples', status='ok')
+            finally:
+                if retry_writer is not None:
+                    retry_writer.close()
+
+        if skipped:
+            logger.info("Skipped %d already processed samples", skipped)
+            get_metrics().inc('samples', skipped, status='skipped')
+
         return result
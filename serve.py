@@ -0,0 +1,157 @@
+import argparse
+import asyncio
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict
+
+from aiohttp import web
+
+from model.micro_batcher import MicroBatcher
+from utils.metrics import configure_metrics, get_metrics
+
+logger = logging.getLogger(__name__)
+
+# Stages waiting on the LLM run several micro-batches at once, the local models one at a time
+LLM_STAGES = ('QuestionGenerator', 'CandidateGenerator')
+
+
+class CorrectionServer:
+    def __init__(self, corrector, max_batch_size=16, max_wait_ms=10, llm_concurrency=8, timeout=120):
+        # Concurrent requests are grouped into micro-batches per stage, and a request flows
+        # through the stages on its own, so different stages work on different batches at once
+        self.corrector = corrector
+        self.timeout = timeout
+        self.active = 0
+
+        stages = corrector.batch_stages()
+        concurrency = {step: llm_concurrency if step in LLM_STAGES else 1 for step, _ in stages}
+        self.executor = ThreadPoolExecutor(max_workers=sum(concurrency.values()), thread_name_prefix="stage")
+        self.batchers = [
+            MicroBatcher(
+                step,
+                self._copying(function),
+                max_batch_size=max_batch_size,
+                max_wait_ms=max_wait_ms,
+                concurrency=concurrency[step],
+                executor=self.executor
+            )
+            for step, function in stages
+        ]
+
+    @staticmethod
+    def _copying(function):
+        # Stages update samples in place, work on copies so a batch retried item by item starts clean
+        def run(samples):
+            return function([dict(sample) for sample in samples])
+
+        return run
+
+    async def correct(self, sample: Dict):
+        for batcher in self.batchers:
+            sample = await batcher.submit(sample)
+        return sample
+
+    async def handle_correct(self, request):
+        try:
+            body = await request.json()
+        except json.JSONDecodeError:
+            raise web.HTTPBadRequest(text="Request body must be JSON")
+        if not isinstance(body, dict) or not isinstance(body.get('claim'), str) or not isinstance(body.get('evidence'), str):
+            raise web.HTTPBadRequest(text="'claim' and 'evidence' must be strings")
+
+        sample = {'input_claim': body['claim'], 'evidence': body['evidence']}
+        metrics = get_metrics()
+        self.active += 1
+        try:
+            # Cancelled when the client disconnects, queued stages then drop the sample
+            with metrics.timer('request_seconds'):
+                sample = await asyncio.wait_for(self.correct(sample), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            metrics.inc('requests', status='timeout')
+            raise web.HTTPGatewayTimeout(text="Correction timed out")
+        except Exception as e:
+            logger.error("Error correcting claim: %r", e, exc_info=e)
+            metrics.inc('requests', status='failed')
+            raise web.HTTPInternalServerError(text=repr(e))
+        finally:
+            self.active -= 1
+
+        metrics.inc('requests', status='ok')
+        return web.json_response(sample, dumps=lambda data: json.dumps(data, ensure_ascii=False))
+
+    async def handle_health(self, request):
+        return web.json_response({
+            'status': 'ok',
+            'active_requests': self.active,
+            'queue_depth': {batcher.name: batcher.queue_depth for batcher in self.batchers},
+            'in_flight': {batcher.name: batcher.in_flight for batcher in self.batchers},
+        })
+
+    async def handle_metrics(self, request):
+        return web.Response(text=get_metrics().to_prometheus(), content_type="text/plain")
+
+    async def on_startup(self, app):
+        for batcher in self.batchers:
+            batcher.start()
+
+    async def on_cleanup(self, app):
+        for batcher in self.batchers:
+            await batcher.close()
+        self.executor.shutdown(wait=False)
+
+    def app(self):
+        app = web.Application()
+        app.add_routes([
+            web.post("/correct", self.handle_correct),
+            web.get("/health", self.handle_health),
+            web.get("/metrics", self.handle_metrics),
+        ])
+        app.on_startup.append(self.on_startup)
+        app.on_cleanup.append(self.on_cleanup)
+        return app
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Serve Vi_ZeroFEC over HTTP with micro-batching across requests")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--max-batch-size", type=int, default=16, help="Largest micro-batch per stage")
+    parser.add_argument("--max-wait-ms", type=float, default=10, help="Time a stage waits for more requests before running a batch")
+    parser.add_argument("--llm-concurrency", type=int, default=8, help="Micro-batches of an LLM stage running at once")
+    parser.add_argument("--timeout", type=float, default=120, help="Request timeout in seconds")
+    parser.add_argument("--backend", default="torch", choices=["torch", "onnx"], help="Inference backend of the QA and entailment models")
+    parser.add_argument("--cascade-threshold", type=float, default=None, help="Return claims entailed by the evidence with at least this score without correcting them")
+    parser.add_argument("--prune-units", action="store_true", help="Drop claim units overlapping a better ranked one before question generation")
+    parser.add_argument("--max-units", type=int, default=None, help="Keep at most this many claim units per claim, implies --prune-units")
+    parser.add_argument("--llm-cache", default=None, metavar="PATH", help="SQLite cache of LLM generations")
+    parser.add_argument("--llm-cache-replay", action="store_true", help="Only read --llm-cache, a missing generation fails the request instead of calling the API")
+    parser.add_argument("--metrics", action="store_true", help="Record metrics, served in Prometheus text on /metrics")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(level=logging.INFO)
+    configure_metrics(enabled=args.metrics)
+
+    from model.vi_zerofec import Vi_ZeroFEC
+    from utils.llm_cache import LLMCache
+
+    llm_cache = LLMCache(args.llm_cache, replay=args.llm_cache_replay) if args.llm_cache else None
+
+    # One corrector, so one set of models and the process-wide LLM scheduler, for every request
+    corrector = Vi_ZeroFEC(llm_cache=llm_cache, inference_backend=args.backend, cascade_threshold=args.cascade_threshold,
+                           prune_claim_units=args.prune_units, max_claim_units=args.max_units, warmup=True)
+    server = CorrectionServer(
+        corrector,
+        max_batch_size=args.max_batch_size,
+        max_wait_ms=args.max_wait_ms,
+        llm_concurrency=args.llm_concurrency,
+        timeout=args.timeout
+    )
+    web.run_app(server.app(), host=args.host, port=args.port, handler_cancellation=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+import asyncio
+import json
+import os
+import sys
+import urllib.error
+import urllib.request
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.stub_server import start_stub_server
+
+
+class HTTPStatusError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+class StubClient:
+    # Minimal async chat client over plain HTTP, shaped like AsyncTogether for the scheduler
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def _post(self, payload):
+        request = urllib.request.Request(
+            self.base_url + "/chat/completions",
+            data=json.dumps(payload).encode("utf-8"),
+            headers={"Content-Type": "application/json"}
+        )
+        try:
+            with urllib.request.urlopen(request) as response:
+                return json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            raise HTTPStatusError(e.code) from None
+
+    async def create(self, model, messages, **kwargs):
+        body = await asyncio.to_thread(self._post, {"model": model, "messages": messages, **kwargs})
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=choice["message"]["content"])) for choice in body["choices"]],
+            usage=SimpleNamespace(**body["usage"])
+        )
+
+
+@pytest.fixture
+def stub_server():
+    # Factory: start a stub LLM server with the given options, shut down after the test
+    servers = []
+
+    def start(**kwargs):
+        server, base_url = start_stub_server(**{"latency_ms": 0, **kwargs})
+        servers.append(server)
+        return server, StubClient(base_url)
+
+    yield start
+    for server in servers:
+        server.shutdown()
@@ -0,0 +1,60 @@
+import json
+
+import pytest
+
+from utils.checkpoint import JsonlWriter, ParquetWriter, load_processed_ids, sample_id
+
+
+def record(i):
+    sample = {'evidence': f"Bằng chứng {i}", 'input_claim': f"Tuyên bố {i}", 'index': i}
+    return {**sample, 'sample_id': sample_id(sample), 'correction': f"Sửa {i}"}
+
+
+def test_sample_id_depends_on_evidence_and_claim_only():
+    assert sample_id({**record(1), 'label': 'Support'}) == sample_id(record(1))
+    assert sample_id(record(1)) != sample_id(record(2))
+
+
+def test_jsonl_resume_drops_the_partial_line(tmp_path):
+    path = str(tmp_path / "out.jsonl")
+    with JsonlWriter(path) as writer:
+        for i in range(3):
+            writer.write(record(i))
+    # A crash in the middle of the fourth record
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(record(3))[:20])
+
+    assert load_processed_ids(path) == {record(i)['sample_id'] for i in range(3)}
+
+    with JsonlWriter(path) as writer:
+        writer.write(record(3))
+    with open(path, encoding="utf-8") as f:
+        assert [json.loads(line)['index'] for line in f] == [0, 1, 2, 3]
+
+
+def test_missing_output_has_no_processed_ids(tmp_path):
+    assert load_processed_ids(str(tmp_path / "out.jsonl")) == set()
+    assert load_processed_ids(str(tmp_path / "out.parquet")) == set()
+
+
+def test_parquet_resume_reads_completed_parts(tmp_path):
+    pytest.importorskip("pyarrow")
+    path = str(tmp_path / "out.parquet")
+
+    # Directory left by a run that crashed before its first part
+    ParquetWriter(path, batch_size=2)
+    assert load_processed_ids(path) == set()
+
+    writer = ParquetWriter(path, batch_size=2)
+    for i in range(5):
+        writer.write(record(i))
+    # The fifth record is still buffered
+    assert load_processed_ids(path) == {record(i)['sample_id'] for i in range(4)}
+    writer.close()
+    assert load_processed_ids(path) == {record(i)['sample_id'] for i in range(5)}
+
+    # Appending continues the part numbering
+    with ParquetWriter(path, batch_size=2) as writer:
+        writer.write(record(5))
+    assert len(ParquetWriter._parts(path)) == 4
+    assert len(load_processed_ids(path)) == 6
@@ -0,0 +1,49 @@
+import os
+
+import pytest
+
+pa = pytest.importorskip("pyarrow")
+pq = pytest.importorskip("pyarrow.parquet")
+pytest.importorskip("pandas")
+pytest.importorskip("fsspec")
+
+from utils.dataset import SPLIT_FILES, ViFactCheck
+
+LABELS = ["Support", "Refute", "Not Enough Information"]
+# The loader strips a 12 character prefix before the evidence
+PREFIX = "Evidence:".ljust(12)
+
+
+@pytest.fixture
+def dataset_path(tmp_path):
+    # Two splits in the ViFactCheck layout, with small row groups
+    os.makedirs(tmp_path / "data")
+    for split, size in [("train", 23), ("dev", 7)]:
+        table = pa.table({
+            'input': [f"{PREFIX}{split} bằng chứng {i}. Sentence: {split} tuyên bố {i}" for i in range(size)],
+            'output': [LABELS[i % 3] for i in range(size)],
+        })
+        pq.write_table(table, tmp_path / SPLIT_FILES[split], row_group_size=4)
+    return str(tmp_path) + "/"
+
+
+def test_lazy_and_eager_loading_match(dataset_path):
+    eager = ViFactCheck(dataset_path, splits=["train", "dev"])
+    lazy = ViFactCheck(dataset_path, splits=["train", "dev"], lazy=True)
+
+    assert len(eager) == len(lazy) == 16 + 5
+    assert list(lazy) == eager.get_all()
+    assert [lazy[i] for i in reversed(range(len(lazy)))] == eager[::-1]
+    eager.close()
+    lazy.close()
+
+
+def test_samples_are_parsed_and_filtered(dataset_path):
+    dataset = ViFactCheck(dataset_path, splits=["dev"], lazy=True)
+
+    assert dataset[0] == {'evidence': "dev bằng chứng 0", 'input_claim': "dev tuyên bố 0", 'label': "Support"}
+    assert dataset[-1]['input_claim'] == "dev tuyên bố 6"
+    assert all(sample['label'] != "Not Enough Information" for sample in dataset)
+    with pytest.raises(IndexError):
+        dataset[len(dataset)]
+    dataset.close()
@@ -0,0 +1,125 @@
+import asyncio
+import time
+
+import pytest
+
+from utils.llm_cache import CacheMissError, LLMCache
+from utils.llm_scheduler import LLMScheduler, TokenBucket
+
+
+def messages(text):
+    return [{"role": "user", "content": f"Thông tin: {text}"}]
+
+
+@pytest.fixture
+def make_scheduler():
+    schedulers = []
+
+    def make(client, **kwargs):
+        scheduler = LLMScheduler(client=client, **{"requests_per_second": 1000, "backoff_base": 0.01, **kwargs})
+        schedulers.append(scheduler)
+        return scheduler
+
+    yield make
+    for scheduler in schedulers:
+        scheduler.close()
+
+
+def test_outputs_follow_request_order(stub_server, make_scheduler):
+    _, client = stub_server(latency_ms=20, jitter_ms=20)
+    scheduler = make_scheduler(client)
+
+    outputs = scheduler.complete_many("stub", [messages(str(i)) for i in range(20)])
+
+    assert outputs == [f"{i} là gì?" for i in range(20)]
+    assert scheduler.stats['requests'] == 20
+
+
+def test_request_rate_is_limited(stub_server, make_scheduler):
+    _, client = stub_server()
+    scheduler = make_scheduler(client, requests_per_second=20)
+
+    start = time.perf_counter()
+    scheduler.complete_many("stub", [messages(str(i)) for i in range(30)])
+
+    # A burst of 20, then 10 more at 20 per second
+    assert time.perf_counter() - start >= 0.45
+
+
+def test_rate_limited_requests_are_retried(stub_server, make_scheduler):
+    server, client = stub_server(failures=2)
+    scheduler = make_scheduler(client, max_retries=3)
+
+    assert scheduler.complete_many("stub", [messages("SAWACO")]) == ["SAWACO là gì?"]
+    assert scheduler.stats['retries'] == 2
+    assert server.requests == 3
+
+
+def test_retries_give_up_after_max_retries(stub_server, make_scheduler):
+    server, client = stub_server(failures=5)
+    scheduler = make_scheduler(client, max_retries=1)
+
+    with pytest.raises(Exception) as error:
+        scheduler.complete_many("stub", [messages("SAWACO")])
+    assert error.value.status_code == 429
+    assert scheduler.stats['failures'] == 1
+    assert server.requests == 2
+
+
+def test_errors_that_are_not_retryable_fail_at_once(make_scheduler):
+    class BadRequest(Exception):
+        status_code = 400
+
+    class FailingClient:
+        def __init__(self):
+            self.calls = 0
+            self.chat = type("Chat", (), {"completions": self})()
+
+        async def create(self, **kwargs):
+            self.calls += 1
+            raise BadRequest()
+
+    client = FailingClient()
+    scheduler = make_scheduler(client, max_retries=3)
+    with pytest.raises(BadRequest):
+        scheduler.complete_many("stub", [messages("SAWACO")])
+    assert client.calls == 1
+
+
+def test_slow_requests_time_out(stub_server, make_scheduler):
+    _, client = stub_server(latency_ms=500)
+    scheduler = make_scheduler(client, timeout=0.05, max_retries=0)
+
+    with pytest.raises(asyncio.TimeoutError):
+        scheduler.complete_many("stub", [messages("SAWACO")])
+
+
+def test_cached_generations_skip_the_api(stub_server, make_scheduler, tmp_path):
+    server, client = stub_server()
+    scheduler = make_scheduler(client)
+    cache = LLMCache(str(tmp_path / "cache.sqlite"))
+
+    first = scheduler.complete_many("stub", [messages("SAWACO")], cache=cache)
+    second = scheduler.complete_many("stub", [messages("SAWACO")], cache=cache)
+    cache.close()
+
+    assert first == second
+    assert server.requests == 1
+
+    replay = LLMCache(str(tmp_path / "cache.sqlite"), replay=True)
+    assert scheduler.complete_many("stub", [messages("SAWACO")], cache=replay) == first
+    with pytest.raises(CacheMissError):
+        scheduler.complete_many("stub", [messages("Tân Hiệp")], cache=replay)
+    replay.close()
+
+
+def test_token_bucket_waits_for_refill():
+    async def run():
+        bucket = TokenBucket(rate=10, capacity=2)
+        start = asyncio.get_running_loop().time()
+        for _ in range(4):
+            await bucket.acquire()
+        return asyncio.get_running_loop().time() - start
+
+    # Two tokens at once, two more at 10 per second
+    assert asyncio.run(run()) >= 0.19
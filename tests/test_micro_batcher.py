@@ -0,0 +1,57 @@
+import asyncio
+
+from model.micro_batcher import MicroBatcher
+
+
+def run_batcher(function, items, **kwargs):
+    batches = []
+
+    def recorded(batch):
+        batches.append(list(batch))
+        return function(batch)
+
+    async def run():
+        batcher = MicroBatcher("test", recorded, **kwargs)
+        batcher.start()
+        try:
+            return await asyncio.gather(*(batcher.submit(item) for item in items), return_exceptions=True)
+        finally:
+            await batcher.close()
+
+    return asyncio.run(run()), batches
+
+
+def test_concurrent_requests_share_batches():
+    results, batches = run_batcher(lambda batch: [x * 2 for x in batch], range(10), max_batch_size=4, max_wait_ms=50)
+
+    assert results == [x * 2 for x in range(10)]
+    assert [len(batch) for batch in batches] == [4, 4, 2]
+
+
+def test_lone_request_waits_at_most_max_wait():
+    async def run():
+        batcher = MicroBatcher("test", lambda batch: batch, max_batch_size=16, max_wait_ms=20)
+        batcher.start()
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        result = await batcher.submit("x")
+        elapsed = loop.time() - start
+        await batcher.close()
+        return result, elapsed
+
+    result, elapsed = asyncio.run(run())
+    assert result == "x"
+    assert elapsed < 1
+
+
+def test_failed_batch_is_retried_item_by_item():
+    def function(batch):
+        if "bad" in batch:
+            raise ValueError("bad item")
+        return [x.upper() for x in batch]
+
+    results, batches = run_batcher(function, ["a", "bad", "c"], max_batch_size=3, max_wait_ms=50)
+
+    assert results[0] == "A" and results[2] == "C"
+    assert isinstance(results[1], ValueError)
+    assert batches == [["a", "bad", "c"], ["a"], ["bad"], ["c"]]
@@ -0,0 +1,81 @@
+import json
+
+import pytest
+
+from utils.checkpoint import JsonlWriter, ParquetWriter, sample_id
+from utils.sharding import (find_shard_outputs, merge_shard_outputs, parse_shard, shard_indices, shard_layouts,
+                            shard_output_path)
+
+
+def record(i, **fields):
+    sample = {'evidence': f"Bằng chứng {i}", 'input_claim': f"Tuyên bố {i}", 'index': i}
+    return {**sample, 'sample_id': sample_id(sample), **fields}
+
+
+def write_parts(output_file, writer_class, num_shards, num_workers, indices):
+    # Write each index to the part of its shard and worker, as main.py splits them
+    paths = []
+    for shard in range(num_shards):
+        shard_part = shard_indices(indices, shard, num_shards)
+        for worker in range(num_workers):
+            path = shard_output_path(output_file, shard, num_shards, worker, num_workers)
+            with writer_class(path) as writer:
+                for i in shard_indices(shard_part, worker, num_workers):
+                    writer.write(record(i))
+            paths.append(path)
+    return paths
+
+
+def test_parse_shard():
+    assert parse_shard("2/4") == (2, 4)
+    for shard in ["4/4", "-1/2", "0/0"]:
+        with pytest.raises(ValueError):
+            parse_shard(shard)
+
+
+def test_shards_cover_the_range_once():
+    indices = list(range(10, 47))
+    shards = [shard_indices(indices, i, 3) for i in range(3)]
+    assert sorted(sum(shards, [])) == indices
+
+
+def test_parts_are_found_per_layout(tmp_path):
+    output_file = str(tmp_path / "out.jsonl")
+    write_parts(output_file, JsonlWriter, 2, 2, list(range(8)))
+    # A rerun of shard 0 with a single worker and an unrelated file
+    write_parts(str(tmp_path / "out.shard0of2.jsonl"), JsonlWriter, 1, 1, [])
+    (tmp_path / "out.shard0of3.worker0of1.jsonl").write_text("")
+
+    assert shard_layouts(output_file) == [2, 3]
+    assert find_shard_outputs(output_file, 0, 2) == [
+        str(tmp_path / "out.shard0of2.worker0of2.jsonl"), str(tmp_path / "out.shard0of2.worker1of2.jsonl")
+    ]
+    assert len(find_shard_outputs(output_file, num_shards=2)) == 4
+
+
+def test_jsonl_merge_sorts_and_deduplicates(tmp_path):
+    output_file = str(tmp_path / "out.jsonl")
+    paths = write_parts(output_file, JsonlWriter, 2, 2, list(range(9)))
+    # A sample written twice by a resumed run
+    with JsonlWriter(paths[0]) as writer:
+        writer.write(record(4))
+
+    assert merge_shard_outputs(output_file, paths) == 9
+    with open(output_file, encoding="utf-8") as f:
+        assert [json.loads(line)['index'] for line in f] == list(range(9))
+
+
+def test_parquet_merge_unifies_extra_fields(tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    output_file = str(tmp_path / "out.parquet")
+    paths = write_parts(output_file, lambda path: ParquetWriter(path, batch_size=2), 1, 2, list(range(6)))
+    # A rerun with one worker writes a part whose records carry an extra field
+    paths.append(shard_output_path(output_file, 0, 1, 0, 1))
+    with ParquetWriter(paths[-1], batch_size=2) as writer:
+        writer.write(record(6, note="thêm"))
+        writer.write(record(1))
+
+    assert merge_shard_outputs(output_file, paths) == 7
+    table = pq.read_table(output_file)
+    assert table['index'].to_pylist() == list(range(7))
+    assert table['note'].to_pylist() == [None] * 6 + ["thêm"]
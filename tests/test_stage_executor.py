@@ -0,0 +1,81 @@
+import random
+import threading
+import time
+
+import pytest
+
+from model.stage_executor import StageExecutor
+
+
+def sleepy(function):
+    def stage(sample):
+        time.sleep(random.uniform(0, 0.005))
+        return function(sample)
+    return stage
+
+
+def test_outputs_follow_input_order():
+    executor = StageExecutor(
+        [("double", sleepy(lambda x: x * 2)), ("increment", sleepy(lambda x: x + 1))],
+        concurrency={"double": 4, "increment": 3}
+    )
+
+    assert [sample for sample, _ in executor.run(range(100))] == [x * 2 + 1 for x in range(100)]
+
+
+def test_failed_sample_skips_later_stages():
+    seen = []
+
+    def fail_on_three(x):
+        if x == 3:
+            raise ValueError("bad sample")
+        return x
+
+    def record(x):
+        seen.append(x)
+        return x
+
+    results = list(StageExecutor([("check", fail_on_three), ("record", record)]).run(range(5)))
+
+    assert [error is None for _, error in results] == [True, True, True, False, True]
+    assert isinstance(results[3][1], ValueError)
+    assert 3 not in seen
+
+
+def test_failing_input_raises_instead_of_hanging():
+    def samples():
+        yield from range(3)
+        raise RuntimeError("dataset error")
+
+    outputs = []
+    finished = threading.Event()
+
+    def consume():
+        with pytest.raises(RuntimeError, match="dataset error"):
+            for sample, _ in StageExecutor([("identity", lambda x: x)]).run(samples()):
+                outputs.append(sample)
+        finished.set()
+
+    thread = threading.Thread(target=consume, daemon=True)
+    thread.start()
+    thread.join(timeout=5)
+
+    assert finished.is_set()
+    assert outputs == [0, 1, 2]
+
+
+def test_closing_the_run_stops_the_workers():
+    calls = []
+
+    def stage(x):
+        calls.append(x)
+        return x
+
+    run = StageExecutor([("identity", stage)], queue_size=2).run(range(1000))
+    assert next(run) == (0, None)
+    run.close()
+
+    time.sleep(0.3)
+    count = len(calls)
+    time.sleep(0.3)
+    assert len(calls) == count < 1000
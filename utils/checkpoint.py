@@ -0,0 +1,226 @@
+import glob
+import hashlib
+import json
+import logging
+import os
+import shutil
+from typing import Dict, Set
+
+logger = logging.getLogger(__name__)
+
+# Arrow types of the output fields, per-unit fields are list columns
+OUTPUT_FIELDS = {
+    'sample_id': 'string',
+    'index': 'int64',
+    'evidence': 'string',
+    'input_claim': 'string',
+    'label': 'string',
+    'claim_answer': 'list<string>',
+    'num_pruned_units': 'int64',
+    'generated_question': 'list<string>',
+    'question_source': 'list<string>',
+    'answer': 'list<string>',
+    'answer_score': 'list<double>',
+    'answer_start': 'list<int64>',
+    'answer_end': 'list<int64>',
+    'num_filtered_answers': 'int64',
+    'candidate': 'list<string>',
+    'num_dropped_candidates': 'int64',
+    'entailment_score': 'list<double>',
+    'rouge_score': 'list<double>',
+    'final_score': 'list<double>',
+    'correction': 'string',
+    'path': 'string',
+    'input_entailment_score': 'double',
+}
+
+
+def sample_id(sample: Dict):
+    # Stable id of a sample: hash of its evidence and input claim
+    content = json.dumps([sample['evidence'], sample['input_claim']], ensure_ascii=False)
+    return hashlib.sha1(content.encode("utf-8")).hexdigest()
+
+
+def arrow_type(alias: str):
+    import pyarrow as pa
+    if alias.startswith("list<"):
+        return pa.list_(arrow_type(alias[5:-1]))
+    return pa.type_for_alias(alias)
+
+
+def is_parquet(path: str):
+    return path.endswith(".parquet")
+
+
+def load_processed_ids(output_file: str) -> Set[str]:
+    # Read back the ids of samples already written by a previous run
+    processed_ids = set()
+    if not os.path.exists(output_file):
+        return processed_ids
+
+    if is_parquet(output_file):
+        # Completed parts only, a run that crashed before its first part leaves an empty directory
+        import pyarrow.parquet as pq
+        parts = [output_file] if os.path.isfile(output_file) else ParquetWriter._parts(output_file)
+        for part in parts:
+            processed_ids.update(pq.read_table(part, columns=['sample_id'])['sample_id'].to_pylist())
+        processed_ids.discard(None)
+        return processed_ids
+
+    with open(output_file, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # Partially written line of an interrupted run
+                continue
+            processed_ids.add(record.get('sample_id') or sample_id(record))
+
+    return processed_ids
+
+
+class JsonlWriter:
+    def __init__(self, path: str, checkpoint_every=50, mode="a"):
+        if mode == "a":
+            self._drop_partial_line(path)
+
+        # One long-lived buffered file, flushed and fsync-ed every checkpoint_every records
+        self.path = path
+        self.checkpoint_every = checkpoint_every
+        self.file = open(path, mode, encoding="utf-8", buffering=1 << 20)
+        self.pending = 0
+
+    @staticmethod
+    def _drop_partial_line(path):
+        # Truncate a trailing line left unfinished by a crash, so appended records stay valid JSONL
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            return
+
+        with open(path, "rb+") as f:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) == b"\n":
+                return
+
+            end = f.seek(0, os.SEEK_END)
+            position = end
+            while position > 0:
+                step = min(1 << 16, position)
+                position -= step
+                f.seek(position)
+                newline = f.read(step).rfind(b"\n")
+                if newline != -1:
+                    f.truncate(position + newline + 1)
+                    return
+            f.truncate(0)
+
+    def write(self, record: Dict):
+        self.file.write(json.dumps(record, ensure_ascii=False))
+        self.file.write("\n")
+        self.pending += 1
+        if self.pending >= self.checkpoint_every:
+            self.checkpoint()
+
+    def checkpoint(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.pending = 0
+
+    def close(self):
+        if not self.file.closed:
+            self.checkpoint()
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class ParquetWriter:
+    def __init__(self, path: str, batch_size=1000, mode="a"):
+        # Directory of parquet parts holding batch_size records each. A part is written to a hidden
+        # temporary file and renamed once complete, so a crash loses at most the current batch
+        import pyarrow.parquet as pq
+
+        if mode == "w" and os.path.isdir(path):
+            shutil.rmtree(path)
+        os.makedirs(path, exist_ok=True)
+
+        self.path = path
+        self.batch_size = batch_size
+        self.records = []
+        self.dropped = set()
+
+        parts = self._parts(path)
+        self.next_part = int(os.path.basename(parts[-1])[5:10]) + 1 if parts else 0
+        # Appended parts keep the schema of the existing ones
+        self.schema = pq.read_schema(parts[0]) if parts else None
+
+    @staticmethod
+    def _parts(path):
+        return sorted(glob.glob(os.path.join(glob.escape(path), "part-[0-9][0-9][0-9][0-9][0-9].parquet")))
+
+    def _make_schema(self, records):
+        # Known output fields plus whatever else the first records carry, with nulls where absent
+        import pyarrow as pa
+
+        fields = [pa.field(name, arrow_type(alias)) for name, alias in OUTPUT_FIELDS.items()]
+        inferred = pa.Table.from_pylist(records).schema
+        for field in inferred:
+            if field.name in OUTPUT_FIELDS:
+                continue
+            if pa.types.is_null(field.type):
+                field = field.with_type(pa.string())
+            elif pa.types.is_list(field.type) and pa.types.is_null(field.type.value_type):
+                field = field.with_type(pa.list_(pa.string()))
+            fields.append(field)
+
+        return pa.schema(fields)
+
+    def write(self, record: Dict):
+        self.records.append(record)
+        if len(self.records) >= self.batch_size:
+            self.checkpoint()
+
+    def checkpoint(self):
+        if not self.records:
+            return
+
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        if self.schema is None:
+            self.schema = self._make_schema(self.records)
+        unknown = {key for record in self.records for key in record} - set(self.schema.names) - self.dropped
+        if unknown:
+            logger.warning("Fields %s are not in the schema of %s and are not saved", sorted(unknown), self.path)
+            self.dropped |= unknown
+
+        table = pa.Table.from_pylist(self.records, schema=self.schema)
+        name = f"part-{self.next_part:05d}.parquet"
+        temporary = os.path.join(self.path, f".{name}.tmp")
+        with open(temporary, "wb") as f:
+            pq.write_table(table, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, os.path.join(self.path, name))
+
+        self.next_part += 1
+        self.records = []
+
+    def close(self):
+        self.checkpoint()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def open_writer(path: str, checkpoint_every=None, mode="a"):
+    # Parquet parts for .parquet outputs, JSONL otherwise
+    if is_parquet(path):
+        return ParquetWriter(path, batch_size=checkpoint_every or 1000, mode=mode)
+    return JsonlWriter(path, checkpoint_every=checkpoint_every or 50, mode=mode)
@@ -1,45 +1,99 @@
-import pandas as pd
+import bisect
+import fsspec
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+SPLIT_FILES = {
+    "train": "data/train-00000-of-00001.parquet",
+    "dev": "data/dev-00000-of-00001.parquet",
+    "test": "data/test-00000-of-00001.parquet",
+}
 
 class ViFactCheck:
-    def __init__(self, base_path="hf://datasets/tranthaihoa/vifactcheck_gold_evidence/"):
-        train_file="data/train-00000-of-00001.parquet"
-        dev_file="data/dev-00000-of-00001.parquet"
-        test_file="data/test-00000-of-00001.parquet"
+    def __init__(self, base_path="hf://datasets/tranthaihoa/vifactcheck_gold_evidence/", splits=("train", "dev", "test"), lazy=False):
+        # Open the parquet files of the selected splits, row groups are only read when needed
+        self.files = [fsspec.open(base_path + SPLIT_FILES[split], "rb").open() for split in splits]
+        self.parquet_files = [pq.ParquetFile(f) for f in self.files]
+
+        # Index the rows kept after filtering, reading only the label column
+        self.groups = []
+        self.offsets = [0]
+        for file_id, parquet_file in enumerate(self.parquet_files):
+            for row_group in range(parquet_file.num_row_groups):
+                labels = parquet_file.read_row_group(row_group, columns=['output'])['output']
+                keep = pc.not_equal(labels, 'Not Enough Information').to_numpy(zero_copy_only=False)
+                self.groups.append((file_id, row_group, pa.array(np.flatnonzero(keep))))
+                self.offsets.append(self.offsets[-1] + int(keep.sum()))
 
-        train_data = pd.read_parquet(base_path + train_file)
-        dev_data = pd.read_parquet(base_path + dev_file)
-        test_data = pd.read_parquet(base_path + test_file)
-        all_data = pd.concat([train_data, dev_data, test_data], axis=0)
+        # Last decoded row group, enough for sequential access
+        self._cache = (None, [])
 
-        self.processed_data = self._convert2dict(all_data)
+        # __iter__ streams row groups while processed_data is None
+        self.processed_data = None
+        if not lazy:
+            self.processed_data = list(self)
         print("Finish loading ViFactCheck dataset")
 
-    def _convert2dict(self, data):
-        # Format and clean input
-        data[['evidence', 'input_claim']] = data['input'].str.split('. Sentence: ', expand=True)
+    def _convert2dict(self, table):
+        # Format and clean input with vectorized string operations, the rows are already filtered
+        if table.num_rows == 0:
+            return []
+        data = table.to_pandas()
+        data[['evidence', 'input_claim']] = data['input'].str.split('. Sentence: ', n=1, expand=True)
         data['evidence'] = data['evidence'].str[12:]
-        data = data.drop(['input', 'instructions', 'len_evidence'], axis=1)
-        data = data[data['output'] != 'Not Enough Information']
-        data = data[['evidence', 'input_claim', 'output']]
 
         # Convert to list of dictionary
-        dict_data = []
-        for i in range(data.shape[0]):
-            row = data.iloc[i]
-            sample = {'evidence': row['evidence'], 'input_claim': row['input_claim'], 'label': row['output']}
-            dict_data.append(sample)
+        return [
+            {'evidence': evidence, 'input_claim': input_claim, 'label': label}
+            for evidence, input_claim, label in zip(data['evidence'], data['input_claim'], data['output'])
+        ]
 
-        return dict_data
+    def _load_group(self, group_id):
+        if self._cache[0] != group_id:
+            file_id, row_group, rows = self.groups[group_id]
+            table = self.parquet_files[file_id].read_row_group(row_group, columns=['input', 'output']).take(rows)
+            self._cache = (group_id, self._convert2dict(table))
+        return self._cache[1]
 
     def __len__(self):
-        return len(self.processed_data)
+        return self.offsets[-1]
 
     def __getitem__(self, idx):
-        return self.processed_data[idx]
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        if self.processed_data is not None:
+            return self.processed_data[idx]
+
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError("ViFactCheck index out of range")
+
+        # Build the sample on demand from its row group
+        group_id = bisect.bisect_right(self.offsets, idx) - 1
+        return dict(self._load_group(group_id)[idx - self.offsets[group_id]])
+
+    def __iter__(self):
+        if self.processed_data is not None:
+            yield from self.processed_data
+            return
+
+        # Stream the dataset row group by row group
+        for group_id in range(len(self.groups)):
+            for sample in self._load_group(group_id):
+                yield dict(sample)
 
     def get_all(self):
+        if self.processed_data is None:
+            return list(self)
         return self.processed_data
 
+    def close(self):
+        for f in self.files:
+            f.close()
+
 
 if __name__ == "__main__":
     # Load dataset
@@ -52,3 +106,11 @@ if __name__ == "__main__":
     print(type(processed_data))
     print(type(processed_data[0]))
     print(processed_data[:3])
+
+    # Lazy loading gives the same samples
+    lazy_data = ViFactCheck(lazy=True)
+    assert len(lazy_data) == len(data)
+    assert lazy_data[:3] == processed_data[:3]
+    assert lazy_data[-1] == processed_data[-1]
+    assert next(iter(lazy_data)) == processed_data[0]
+    print("Eager and lazy loading match")
@@ -0,0 +1,123 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from typing import Dict, List
+
+
+class CacheMissError(KeyError):
+    pass
+
+
+class LLMCache:
+    def __init__(self, path="llm_cache.sqlite", max_size_mb=1024, replay=False, touch_every=64):
+        # replay: read-only mode, a miss raises CacheMissError instead of calling the API
+        self.path = path
+        self.max_size = int(max_size_mb * 1024 * 1024)
+        self.replay = replay
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+        # LRU timestamps of hits are written in one transaction every touch_every hits, not one per hit
+        self.touch_every = touch_every
+        self.touched = {}
+
+        if replay:
+            self.conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        else:
+            self.conn = sqlite3.connect(path, check_same_thread=False)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS generations ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)"
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS generations_last_access ON generations (last_access)")
+            self.conn.commit()
+
+        self.size = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM generations").fetchone()[0]
+
+    @staticmethod
+    def make_key(model_name: str, messages: List[Dict]):
+        # Content address: model name plus the exact message list
+        content = json.dumps({"model": model_name, "messages": messages}, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+    def get(self, model_name: str, messages: List[Dict]):
+        key = self.make_key(model_name, messages)
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM generations WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                if self.replay:
+                    raise CacheMissError(f"No cached generation for key {key}")
+                return None
+
+            self.hits += 1
+            if not self.replay:
+                # Refresh the entry for LRU eviction
+                self.touched[key] = time.time()
+                if len(self.touched) >= self.touch_every:
+                    self._flush_touched()
+                    self.conn.commit()
+
+        return row[0]
+
+    def _flush_touched(self):
+        self.conn.executemany(
+            "UPDATE generations SET last_access = ? WHERE key = ?",
+            [(last_access, key) for key, last_access in self.touched.items()]
+        )
+        self.touched = {}
+
+    def put(self, model_name: str, messages: List[Dict], value: str):
+        if self.replay:
+            return
+
+        key = self.make_key(model_name, messages)
+        size = len(key) + len(value.encode("utf-8"))
+        with self.lock:
+            old = self.conn.execute("SELECT size FROM generations WHERE key = ?", (key,)).fetchone()
+            self.conn.execute(
+                "INSERT OR REPLACE INTO generations (key, value, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, value, size, time.time())
+            )
+            self.size += size - (old[0] if old else 0)
+            self._flush_touched()
+            self._evict()
+            self.conn.commit()
+
+    def _evict(self):
+        # Drop least recently used entries until the cache fits its size budget
+        while self.size > self.max_size:
+            rows = self.conn.execute(
+                "SELECT key, size FROM generations ORDER BY last_access LIMIT 100"
+            ).fetchall()
+            if not rows:
+                self.size = 0
+                return
+            for key, size in rows:
+                self.conn.execute("DELETE FROM generations WHERE key = ?", (key,))
+                self.size -= size
+                if self.size <= self.max_size:
+                    return
+
+    def stats(self):
+        with self.lock:
+            entries = self.conn.execute("SELECT COUNT(*) FROM generations").fetchone()[0]
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+            'entries': entries,
+            'size_bytes': self.size,
+        }
+
+    def close(self):
+        with self.lock:
+            if self.touched:
+                self._flush_touched()
+                self.conn.commit()
+        self.conn.close()
@@ -0,0 +1,181 @@
+import asyncio
+import os
+import random
+import threading
+from concurrent.futures import Future
+from typing import Dict, List
+
+from utils.metrics import get_metrics
+
+# HTTP statuses worth retrying: timeouts, rate limits and server errors
+RETRY_STATUS = {408, 409, 429, 500, 502, 503, 504}
+RETRY_ERRORS = {"RateLimitError", "ServiceUnavailableError", "Timeout", "APIConnectionError"}
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        # rate: tokens added per second, capacity: maximum burst
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = None
+        self.lock = None
+
+    def _refill(self, now):
+        if self.updated is not None:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def consume(self, amount):
+        # Take tokens without waiting, the balance may go negative to account for underestimates
+        self._refill(asyncio.get_running_loop().time())
+        self.tokens -= amount
+
+    async def acquire(self, amount=1):
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+
+        amount = min(amount, self.capacity)
+        loop = asyncio.get_running_loop()
+        # Serve waiters in arrival order
+        async with self.lock:
+            while True:
+                self._refill(loop.time())
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+
+class LLMScheduler:
+    def __init__(self, api_key=None, base_url=None, requests_per_second=5, tokens_per_minute=None,
+                 max_concurrency=32, timeout=60, max_retries=5, backoff_base=1.0, backoff_max=30.0,
+                 expected_completion_tokens=64, client=None):
+        self.requests_bucket = TokenBucket(requests_per_second, max(1, requests_per_second))
+        self.tokens_bucket = TokenBucket(tokens_per_minute / 60, tokens_per_minute) if tokens_per_minute else None
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.expected_completion_tokens = expected_completion_tokens
+        self.semaphore = None
+
+        # Retries are handled here, so the client must not retry on its own
+        if client is None:
+            from together import AsyncTogether
+            client = AsyncTogether(
+                api_key=api_key or os.environ.get("TOGETHER_API_KEY", ""),
+                base_url=base_url or os.environ.get("TOGETHER_BASE_URL"),
+                max_retries=0
+            )
+        self.client = client
+
+        # Counters
+        self.stats = {'requests': 0, 'retries': 0, 'failures': 0, 'prompt_tokens': 0, 'completion_tokens': 0}
+
+        # Persistent event loop shared by every caller of the process
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="llm-scheduler", daemon=True)
+        self.thread.start()
+
+    def _estimate_tokens(self, messages: List[Dict]):
+        # Rough token count of a Vietnamese prompt, corrected with the reported usage afterwards
+        return sum(len(message['content']) for message in messages) // 3 + self.expected_completion_tokens
+
+    @staticmethod
+    def _is_retryable(error):
+        if isinstance(error, (asyncio.TimeoutError, ConnectionError)):
+            return True
+        if type(error).__name__ in RETRY_ERRORS:
+            return True
+        status = getattr(error, 'http_status', None) or getattr(error, 'status_code', None)
+        if status is None:
+            status = getattr(getattr(error, 'response', None), 'status_code', None)
+        return status is not None and (status in RETRY_STATUS or status >= 500)
+
+    async def acomplete(self, model: str, messages: List[Dict], cache=None, **kwargs):
+        # Must run on self.loop, use submit() from other threads.
+        # SQLite reads and writes of the cache run in the default executor so they never stall the loop
+        loop = asyncio.get_running_loop()
+        if cache is not None:
+            output = await loop.run_in_executor(None, cache.get, model, messages)
+            get_metrics().inc('llm_cache', result='hit' if output is not None else 'miss')
+            if output is not None:
+                return output
+
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        estimate = self._estimate_tokens(messages)
+        for attempt in range(self.max_retries + 1):
+            await self.requests_bucket.acquire(1)
+            if self.tokens_bucket is not None:
+                await self.tokens_bucket.acquire(estimate)
+
+            metrics = get_metrics()
+            try:
+                self.stats['requests'] += 1
+                metrics.inc('llm_requests', model=model)
+                async with self.semaphore:
+                    with metrics.timer('llm_request_seconds', model=model):
+                        response = await asyncio.wait_for(
+                            self.client.chat.completions.create(model=model, messages=messages, **kwargs),
+                            timeout=self.timeout
+                        )
+            except Exception as e:
+                if attempt >= self.max_retries or not self._is_retryable(e):
+                    self.stats['failures'] += 1
+                    metrics.inc('llm_failures', model=model)
+                    raise
+                # Exponential backoff with full jitter
+                self.stats['retries'] += 1
+                metrics.inc('llm_retries', model=model)
+                await asyncio.sleep(random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt)))
+                continue
+
+            usage = getattr(response, 'usage', None)
+            if usage is not None:
+                self.stats['prompt_tokens'] += usage.prompt_tokens or 0
+                self.stats['completion_tokens'] += usage.completion_tokens or 0
+                metrics.inc('llm_tokens', usage.prompt_tokens or 0, model=model, kind='prompt')
+                metrics.inc('llm_tokens', usage.completion_tokens or 0, model=model, kind='completion')
+                if self.tokens_bucket is not None:
+                    self.tokens_bucket.consume((usage.total_tokens or 0) - estimate)
+
+            output = response.choices[0].message.content
+            if cache is not None:
+                await loop.run_in_executor(None, cache.put, model, messages, output)
+            return output
+
+    def submit(self, model: str, messages: List[Dict], cache=None, **kwargs) -> Future:
+        # Thread-safe: schedule one chat completion on the shared loop
+        return asyncio.run_coroutine_threadsafe(self.acomplete(model, messages, cache=cache, **kwargs), self.loop)
+
+    def complete_many(self, model: str, requests: List[List[Dict]], cache=None, **kwargs):
+        # Send all requests at once and return their outputs in request order
+        futures = [self.submit(model, messages, cache=cache, **kwargs) for messages in requests]
+        return [future.result() for future in futures]
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler(**kwargs) -> LLMScheduler:
+    # Process-wide scheduler, kwargs only apply when it is first created
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = LLMScheduler(**kwargs)
+        return _scheduler
+
+
+def set_scheduler(scheduler: LLMScheduler):
+    global _scheduler
+    with _scheduler_lock:
+        _scheduler = scheduler
@@ -0,0 +1,183 @@
+import bisect
+import json
+import threading
+import time
+from typing import Dict
+
+# Default histogram buckets: seconds for latencies, plain numbers for counts
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120]
+COUNT_BUCKETS = [0, 1, 2, 4, 8, 16, 32, 64, 128, 256]
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _Timer:
+    def __init__(self, metrics, name, labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        self.wall_start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        duration = time.perf_counter() - self.start
+        self.metrics.observe(self.name, duration, buckets=LATENCY_BUCKETS, **self.labels)
+        if self.metrics.trace_file is not None:
+            self.metrics.span(self.name, self.wall_start, duration, error=exc_type is not None, **self.labels)
+        return False
+
+
+class Metrics:
+    def __init__(self, enabled=False, trace_file: str = None, prefix="vi_zerofec"):
+        # When disabled every call returns right away
+        self.enabled = enabled
+        self.prefix = prefix
+        self.counters = {}
+        self.histograms = {}
+        self.lock = threading.Lock()
+        self.trace_file = open(trace_file, "a", encoding="utf-8") if enabled and trace_file else None
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name: str, value=1, **labels):
+        if not self.enabled:
+            return
+        key = self._key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, value, buckets=COUNT_BUCKETS, **labels):
+        if not self.enabled:
+            return
+        key = self._key(name, labels)
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram(buckets)
+            self.histograms[key].observe(value)
+
+    def timer(self, name: str, **labels):
+        # Context manager recording the duration of a block, and a span when tracing
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, name, labels)
+
+    def span(self, name: str, start: float, duration: float, **attributes):
+        record = {
+            'name': name,
+            'start': start,
+            'duration': duration,
+            'thread': threading.current_thread().name,
+            **attributes,
+        }
+        with self.lock:
+            self.trace_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def snapshot(self) -> Dict:
+        with self.lock:
+            return {
+                'counters': [
+                    {'name': name, 'labels': dict(labels), 'value': value}
+                    for (name, labels), value in sorted(self.counters.items())
+                ],
+                'histograms': [
+                    {
+                        'name': name,
+                        'labels': dict(labels),
+                        'buckets': histogram.buckets,
+                        'counts': histogram.counts,
+                        'sum': histogram.sum,
+                        'count': histogram.count,
+                    }
+                    for (name, labels), histogram in sorted(self.histograms.items())
+                ],
+            }
+
+    def to_prometheus(self):
+        def format_labels(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ""
+            return "{" + ",".join(f'{key}="{value}"' for key, value in pairs) + "}"
+
+        lines = []
+        with self.lock:
+            seen = set()
+            for (name, labels), value in sorted(self.counters.items()):
+                metric = f"{self.prefix}_{name}_total"
+                if metric not in seen:
+                    lines.append(f"# TYPE {metric} counter")
+                    seen.add(metric)
+                lines.append(f"{metric}{format_labels(labels)} {value}")
+
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                metric = f"{self.prefix}_{name}"
+                if metric not in seen:
+                    lines.append(f"# TYPE {metric} histogram")
+                    seen.add(metric)
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + ["+Inf"], histogram.counts):
+                    cumulative += count
+                    lines.append(f"{metric}_bucket{format_labels(labels, [('le', bound)])} {cumulative}")
+                lines.append(f"{metric}_sum{format_labels(labels)} {histogram.sum}")
+                lines.append(f"{metric}_count{format_labels(labels)} {histogram.count}")
+
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str):
+        # Prometheus text for .prom/.txt files, JSON otherwise
+        if not self.enabled:
+            return
+        with open(path, "w", encoding="utf-8") as f:
+            if path.endswith((".prom", ".txt")):
+                f.write(self.to_prometheus())
+            else:
+                json.dump(self.snapshot(), f, ensure_ascii=False, indent=2)
+        if self.trace_file is not None:
+            self.trace_file.flush()
+
+    def close(self):
+        if self.trace_file is not None:
+            self.trace_file.close()
+            self.trace_file = None
+
+
+_metrics = Metrics(enabled=False)
+
+
+def get_metrics() -> Metrics:
+    return _metrics
+
+
+def configure_metrics(enabled=True, trace_file: str = None) -> Metrics:
+    # Replace the process-wide metrics, instrumented code looks them up on every call
+    global _metrics
+    _metrics.close()
+    _metrics = Metrics(enabled=enabled, trace_file=trace_file)
+    return _metrics
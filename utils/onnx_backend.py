@@ -0,0 +1,167 @@
+import copy
+import os
+import shutil
+import tempfile
+from typing import Callable, Dict, List
+import torch
+
+# Exported graphs are kept here, one directory per model
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "vi_zerofec", "onnx")
+
+
+class _ExportWrapper(torch.nn.Module):
+    # Expose only (input_ids, attention_mask) -> the named logits to the exporter
+    def __init__(self, model, output_names: List[str], model_kwargs: Dict = None):
+        super().__init__()
+        self.model = model
+        self.output_names = output_names
+        self.model_kwargs = model_kwargs or {}
+
+    def forward(self, input_ids, attention_mask):
+        outputs = self.model(input_ids=input_ids, attention_mask=attention_mask, return_dict=True, **self.model_kwargs)
+        return tuple(outputs[name] for name in self.output_names)
+
+
+def export_onnx(load_torch_model: Callable, tokenizer, export_dir: str, output_names: List[str],
+                quantize=True, model_kwargs: Dict = None):
+    # Export once, later calls reuse the files in export_dir. Files are written in a temporary
+    # directory and moved into place when complete, so processes starting together never see a
+    # partial export and a crashed export is redone
+    onnx_path = os.path.join(export_dir, "model.onnx")
+    quantized_path = os.path.join(export_dir, "model_quantized.onnx")
+
+    if not os.path.exists(onnx_path):
+        parent = os.path.dirname(export_dir)
+        os.makedirs(parent, exist_ok=True)
+        temporary = tempfile.mkdtemp(prefix=f".{os.path.basename(export_dir)}.", dir=parent)
+        try:
+            # Export a copy, the model may be the live one of a PyTorch scorer on another device
+            model = copy.deepcopy(load_torch_model()).to("cpu").eval()
+            dummy = tokenizer("Xin chào", "Việt Nam", return_tensors="pt")
+            dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in ["input_ids", "attention_mask"] + output_names}
+            with torch.inference_mode():
+                torch.onnx.export(
+                    _ExportWrapper(model, output_names, model_kwargs),
+                    (dummy["input_ids"], dummy["attention_mask"]),
+                    os.path.join(temporary, "model.onnx"),
+                    input_names=["input_ids", "attention_mask"],
+                    output_names=output_names,
+                    dynamic_axes=dynamic_axes,
+                    opset_version=14
+                )
+            model.config.save_pretrained(temporary)
+            if quantize:
+                _quantize(os.path.join(temporary, "model.onnx"), os.path.join(temporary, "model_quantized.onnx"))
+
+            if os.path.isdir(export_dir) and not os.path.exists(onnx_path):
+                # Left by an export that crashed before this one
+                shutil.rmtree(export_dir, ignore_errors=True)
+            try:
+                os.replace(temporary, export_dir)
+            except OSError:
+                # Another process moved its complete export into place first
+                if not os.path.exists(onnx_path):
+                    raise
+        finally:
+            shutil.rmtree(temporary, ignore_errors=True)
+
+    if not quantize:
+        return "model.onnx"
+
+    if not os.path.exists(quantized_path):
+        # Exported earlier without quantization
+        temporary = os.path.join(export_dir, f".model_quantized.{os.getpid()}.onnx")
+        try:
+            _quantize(onnx_path, temporary)
+            os.replace(temporary, quantized_path)
+        finally:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+
+    return "model_quantized.onnx"
+
+
+def _quantize(onnx_path: str, quantized_path: str):
+    # Dynamic int8 quantization of the weights, activations stay fp32
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    quantize_dynamic(onnx_path, quantized_path, weight_type=QuantType.QInt8)
+
+
+def load_onnx_model(ort_model_class, load_torch_model: Callable, tokenizer, model_name: str, output_names: List[str],
+                    cache_dir: str = None, quantize=True, num_threads=None, model_kwargs: Dict = None):
+    try:
+        import onnxruntime as ort
+    except ImportError as e:
+        raise ImportError("The ONNX backend requires onnxruntime and optimum: pip install onnxruntime optimum") from e
+
+    export_dir = os.path.join(cache_dir or DEFAULT_CACHE_DIR, model_name.replace("/", "--"))
+    file_name = export_onnx(load_torch_model, tokenizer, export_dir, output_names, quantize=quantize, model_kwargs=model_kwargs)
+
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    options.intra_op_num_threads = num_threads or torch.get_num_threads()
+    options.inter_op_num_threads = 1
+
+    return ort_model_class.from_pretrained(
+        export_dir,
+        file_name=file_name,
+        provider="CPUExecutionProvider",
+        session_options=options
+    )
+
+
+def check_parity(samples: List[Dict], cache_dir: str, quantize=True, num_threads=None):
+    # Compare the ONNX Runtime backend with the PyTorch one on the same weights
+    from model.tasks.correction_scoring import EntailmentModel
+    from model.tasks.question_answering import QuestionAnswering
+
+    report = {}
+
+    torch_scorer = EntailmentModel()
+    onnx_scorer = EntailmentModel(backend="onnx", onnx_cache_dir=cache_dir, quantize=quantize,
+                                  num_threads=num_threads, torch_model=torch_scorer.model)
+    torch_scores = []
+    onnx_scores = []
+    agreements = []
+    for sample in samples:
+        torch_result = torch_scorer.compute_entailment({**sample, 'candidate': list(sample['candidate'])})
+        onnx_result = onnx_scorer.compute_entailment({**sample, 'candidate': list(sample['candidate'])})
+        torch_scores += torch_result['entailment_score']
+        onnx_scores += onnx_result['entailment_score']
+        agreements.append(torch_result['correction'] == onnx_result['correction'])
+    differences = [abs(a - b) for a, b in zip(torch_scores, onnx_scores)]
+    report['EntailmentModel'] = {
+        'max_abs_diff': max(differences),
+        'mean_abs_diff': sum(differences) / len(differences),
+        'correction_agreement': sum(agreements) / len(agreements),
+    }
+
+    torch_qa = QuestionAnswering()
+    onnx_qa = QuestionAnswering(backend="onnx", onnx_cache_dir=cache_dir, quantize=quantize, num_threads=num_threads)
+    torch_answers = [answer for sample in torch_qa.batch_answer_question([dict(s) for s in samples]) for answer in sample['answer']]
+    onnx_answers = [answer for sample in onnx_qa.batch_answer_question([dict(s) for s in samples]) for answer in sample['answer']]
+    report['QuestionAnswering'] = {
+        'exact_match': sum(a == b for a, b in zip(torch_answers, onnx_answers)) / len(torch_answers),
+        'mismatches': [[a, b] for a, b in zip(torch_answers, onnx_answers) if a != b],
+    }
+
+    return report
+
+
+if __name__ == "__main__":
+    import json
+
+    # Input
+    samples = [{
+        "input_claim": "SAWACO thông báo tạm ngưng cung cấp nước để thực hiện công tác bảo trì, bảo dưỡng định kỳ Nhà máy nước Tân Hiệp, thời gian thực hiện dự kiến từ 12 giờ ngày 25-3 (thứ bảy) đến 4 giờ ngày 26-3 (chủ nhật).",
+        "evidence": 'SAWACO thông báo tạm ngưng cung cấp nước để thực hiện công tác bảo trì, bảo dưỡng định kỳ Nhà máy nước Tân Hiệp. Thời gian thực hiện dự kiến từ 22 giờ ngày 25-3 (thứ bảy) đến 4 giờ ngày 26-3 (chủ nhật).',
+        "candidate": [
+            "SAWACO thông báo tạm ngưng cấp nước để thực hiện công tác bảo trì định kỳ Nhà máy nước Tân Hiệp, thời gian thực hiện dự kiến từ 22 giờ ngày 25-3 (thứ bảy) đến 4 giờ ngày 26-3 (chủ nhật).",
+            "SAWACO thông báo tạm ngưng cung cấp nước để thực hiện công tác bảo dưỡng định kỳ Nhà máy nước Tân Hiệp, thời gian thực hiện dự kiến từ 12 giờ ngày 25-3 (thứ bảy) đến 4 giờ ngày 26-3 (chủ nhật)."
+        ],
+        "generated_question": ['SAWACO thông báo gì?', 'Việc ngừng cung cấp nước là tạm thời hay vĩnh viễn?', 'Ai thông báo tạm ngừng cấp nước để bảo dưỡng định kỳ Nhà máy nước Tân Hiệp?']
+    }]
+
+    # Export into a fresh directory so both backends share the same weights
+    with tempfile.TemporaryDirectory() as cache_dir:
+        print(json.dumps(check_parity(samples, cache_dir), ensure_ascii=False, indent=2))
@@ -0,0 +1,64 @@
+import json
+import re
+from typing import Callable, List, Optional
+
+from utils.metrics import get_metrics
+
+NUMBERED_LINE = re.compile(r"^\s*(\d+)\s*[.):\-]\s*(.+?)\s*$", re.MULTILINE)
+
+
+def numbered(items: List[str]):
+    return "\n".join(f"{i + 1}. {item}" for i, item in enumerate(items))
+
+
+def parse_list(output: str, expected: int) -> List[Optional[str]]:
+    # Read a JSON array, or failing that a numbered list, of exactly `expected` items.
+    # Items that are missing or empty are None so the caller can ask for them one by one
+    start, end = output.find("["), output.rfind("]")
+    if 0 <= start < end:
+        try:
+            items = json.loads(output[start:end + 1])
+        except json.JSONDecodeError:
+            items = None
+        if isinstance(items, list) and len(items) == expected:
+            items = [str(item).strip() if item is not None else "" for item in items]
+            return [item or None for item in items]
+
+    parsed = {}
+    for number, text in NUMBERED_LINE.findall(output):
+        number = int(number)
+        if 1 <= number <= expected and number not in parsed:
+            parsed[number] = text.strip()
+    return [parsed.get(number) or None for number in range(1, expected + 1)]
+
+
+def generate_packed(backend, items_per_sample: List[List], build_single: Callable, build_packed: Callable,
+                    pack_size: int) -> List[List[str]]:
+    # Send up to pack_size items of a sample per request, items whose answer cannot be parsed
+    # are sent again on their own. Returns the raw outputs per sample in item order.
+    # build_single(sample_idx, item) and build_packed(sample_idx, items) return chat messages
+    requests = []
+    chunks = []
+    for sample_idx, items in enumerate(items_per_sample):
+        for start in range(0, len(items), pack_size):
+            chunk = items[start:start + pack_size]
+            requests.append(build_single(sample_idx, chunk[0]) if len(chunk) == 1 else build_packed(sample_idx, chunk))
+            chunks.append((sample_idx, start, len(chunk)))
+
+    outputs = [[None] * len(items) for items in items_per_sample]
+    fallbacks = []
+    for (sample_idx, start, count), output in zip(chunks, backend.generate(requests) if requests else []):
+        parsed = [output] if count == 1 else parse_list(output, count)
+        for offset, text in enumerate(parsed):
+            if text is None:
+                fallbacks.append((sample_idx, start + offset))
+            else:
+                outputs[sample_idx][start + offset] = text
+
+    if fallbacks:
+        get_metrics().inc('packed_fallbacks', len(fallbacks))
+        requests = [build_single(sample_idx, items_per_sample[sample_idx][idx]) for sample_idx, idx in fallbacks]
+        for (sample_idx, idx), output in zip(fallbacks, backend.generate(requests)):
+            outputs[sample_idx][idx] = output
+
+    return outputs
@@ -0,0 +1,160 @@
+import glob
+import json
+import os
+import re
+import shutil
+from typing import List
+
+from utils.checkpoint import is_parquet
+
+
+def parse_shard(shard: str):
+    # "i/N" -> (i, N)
+    index, count = (int(value) for value in shard.split("/"))
+    if count < 1 or not 0 <= index < count:
+        raise ValueError(f"Invalid shard {shard}, expected i/N with 0 <= i < N")
+    return index, count
+
+
+def shard_indices(indices: List[int], index: int, count: int):
+    # Round-robin split keeps every shard spread over the whole range
+    return indices[index::count]
+
+
+def shard_output_path(output_file: str, shard: int, num_shards: int, worker: int, num_workers: int):
+    stem, ext = os.path.splitext(output_file)
+    return f"{stem}.shard{shard}of{num_shards}.worker{worker}of{num_workers}{ext}"
+
+
+# Suffix of a part name between the output stem and extension: shard, shard count, worker, worker count
+PART_SUFFIX = re.compile(r"\.shard(\d+)of(\d+)\.worker(\d+)of(\d+)")
+
+
+def _parse_parts(output_file: str):
+    # (path, shard, num_shards) of every part of output_file, retry files excluded
+    stem, ext = os.path.splitext(output_file)
+    for path in glob.glob(f"{glob.escape(stem)}.shard*of*.worker*of*{ext}"):
+        match = PART_SUFFIX.fullmatch(path[len(stem):len(path) - len(ext)])
+        if match:
+            yield path, int(match.group(1)), int(match.group(2))
+
+
+def find_shard_outputs(output_file: str, shard: int = None, num_shards: int = None):
+    # Parts of the given shard layout, whatever the number of workers that wrote them
+    return sorted(
+        path for path, part_shard, part_num_shards in _parse_parts(output_file)
+        if (num_shards is None or part_num_shards == num_shards) and (shard is None or part_shard == shard)
+    )
+
+
+def shard_layouts(output_file: str):
+    # Shard counts of the parts on disk
+    return sorted({part_num_shards for _, _, part_num_shards in _parse_parts(output_file)})
+
+
+def _index_records(path):
+    # (dataset index, byte offset) of every complete record of a part file
+    offset = 0
+    with open(path, "rb") as f:
+        for line in f:
+            try:
+                index = json.loads(line)['index']
+            except (json.JSONDecodeError, KeyError):
+                index = None
+            if index is not None:
+                yield index, offset
+            offset += len(line)
+
+
+def _parquet_files(path):
+    # A part is a directory of parquet files (ParquetWriter) or a single file
+    if os.path.isdir(path):
+        return sorted(glob.glob(os.path.join(glob.escape(path), "part-[0-9][0-9][0-9][0-9][0-9].parquet")))
+    return [path]
+
+
+def _merge_parquet(output_file: str, paths: List[str]):
+    # Columnar outputs: only (index, file, row group, row) entries are kept in memory, records are
+    # written in dataset index order one row group at a time, keeping the first record of each sample_id
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    files = [pq.ParquetFile(path) for part in paths for path in _parquet_files(part)]
+    entries = []
+    for file_id, parquet_file in enumerate(files):
+        for row_group in range(parquet_file.num_row_groups):
+            columns = parquet_file.read_row_group(row_group, columns=['index', 'sample_id']).to_pydict()
+            for row, (index, sid) in enumerate(zip(columns['index'], columns['sample_id'])):
+                if index is not None:
+                    entries.append((index, file_id, row_group, row, sid))
+    entries.sort()
+
+    # Appended parts may differ in their extra fields, the merged file has the union of them
+    schema = pa.unify_schemas([parquet_file.schema_arrow for parquet_file in files]) if files else None
+
+    if os.path.isdir(output_file):
+        shutil.rmtree(output_file)
+    if schema is None:
+        return 0
+
+    def conform(table):
+        # Null columns for the fields a part does not have
+        return pa.table({
+            field.name: table[field.name].cast(field.type) if field.name in table.column_names else pa.nulls(len(table), field.type)
+            for field in schema
+        }, schema=schema)
+
+    count = 0
+    seen = set()
+    batch = []
+    # Current row group of each file: a file's records are mostly in index order
+    cached = {}
+    with pq.ParquetWriter(output_file, schema) as writer:
+        for index, file_id, row_group, row, sid in entries:
+            if sid in seen:
+                continue
+            seen.add(sid)
+
+            if file_id not in cached or cached[file_id][0] != row_group:
+                cached[file_id] = (row_group, conform(files[file_id].read_row_group(row_group)))
+            batch.append(cached[file_id][1].slice(row, 1))
+            if len(batch) >= 1000:
+                writer.write_table(pa.concat_tables(batch))
+                count += len(batch)
+                batch = []
+        if batch:
+            writer.write_table(pa.concat_tables(batch))
+            count += len(batch)
+
+    return count
+
+
+def merge_shard_outputs(output_file: str, paths: List[str] = None):
+    # Sort records of all parts by dataset index, only (index, offset) pairs are kept in memory
+    paths = paths if paths is not None else find_shard_outputs(output_file)
+    if is_parquet(output_file):
+        return _merge_parquet(output_file, paths)
+
+    entries = sorted(
+        (index, path_id, offset)
+        for path_id, path in enumerate(paths)
+        for index, offset in _index_records(path)
+    )
+
+    files = [open(path, "rb") for path in paths]
+    count = 0
+    last_index = None
+    try:
+        with open(output_file, "wb") as out:
+            for index, path_id, offset in entries:
+                if index == last_index:
+                    continue
+                files[path_id].seek(offset)
+                out.write(files[path_id].readline().rstrip(b"\n") + b"\n")
+                last_index = index
+                count += 1
+    finally:
+        for f in files:
+            f.close()
+
+    return count